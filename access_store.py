@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+SQLite store for Slack Exporter's access-control allowlists.
+
+Every allowlist (the allowed users, the allowed channels) is a set of ids in
+one indexed table. Writes are transactions, so concurrent admin requests in
+several gunicorn workers cannot lose each other's changes, and a bulk change
+of thousands of ids is a single commit. Each process caches the lists as
+frozensets and re-reads them only after some connection has committed a
+change, which SQLite reports through PRAGMA data_version.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS allowlist (
+    kind TEXT NOT NULL,
+    id TEXT NOT NULL,
+    PRIMARY KEY (kind, id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class AllowlistStore:
+    """Allowlists kept in one SQLite file, safe to share between threads and
+    processes
+
+    legacy_files maps a kind to the JSON file ({"items": [...]}) that held it
+    before; each is imported once, the first time the store is opened.
+    """
+
+    def __init__(self, path, legacy_files=None):
+        self.path = path
+        self.legacy_files = dict(legacy_files or {})
+        self._lock = threading.RLock()
+        self._conn = None
+        self._pid = None
+        self._version = None
+        self._cache = {}
+
+    def _connection(self):
+        """The connection of this process; a forked worker opens its own"""
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None
+            )
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn, self._pid = conn, os.getpid()
+            self._version = None
+            self._cache = {}
+            self._import_legacy()
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+    def _transaction(self, func):
+        """Run func(conn) in a write transaction and return its result"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            # data_version only moves for commits by other connections
+            self._cache = {}
+            return result
+
+    def _import_legacy(self):
+        def run(conn):
+            for kind, filepath in self.legacy_files.items():
+                key = "imported:%s" % kind
+                if conn.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone():
+                    continue
+                try:
+                    with open(filepath, encoding="utf-8") as f:
+                        ids = json.load(f).get("items", [])
+                except FileNotFoundError:
+                    ids = []
+                except (ValueError, OSError) as e:
+                    print(f"Error importing {filepath}: {e}")
+                    ids = []
+                conn.executemany(
+                    "INSERT OR IGNORE INTO allowlist (kind, id) VALUES (?, ?)",
+                    ((kind, x) for x in ids),
+                )
+                conn.execute(
+                    "INSERT INTO meta (key, value) VALUES (?, ?)", (key, filepath)
+                )
+
+        self._transaction(run)
+
+    # reads
+
+    def items(self, kind):
+        """The ids of an allowlist; O(1) membership tests on the result"""
+        with self._lock:
+            conn = self._connection()
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._version:
+                self._cache = {}
+                self._version = version
+            items = self._cache.get(kind)
+            if items is None:
+                items = frozenset(
+                    x
+                    for x, in conn.execute(
+                        "SELECT id FROM allowlist WHERE kind = ?", (kind,)
+                    )
+                )
+                self._cache[kind] = items
+            return items
+
+    def contains(self, kind, item_id):
+        return item_id in self.items(kind)
+
+    # writes
+
+    def update(self, kind, add=(), remove=()):
+        """Add and remove ids in one transaction; returns the number of ids
+        (added, removed)"""
+
+        def run(conn):
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO allowlist (kind, id) VALUES (?, ?)",
+                ((kind, x) for x in add),
+            )
+            added = conn.total_changes - before
+            conn.executemany(
+                "DELETE FROM allowlist WHERE kind = ? AND id = ?",
+                ((kind, x) for x in remove),
+            )
+            return added, conn.total_changes - before - added
+
+        return self._transaction(run)
+
+    def add(self, kind, ids):
+        return self.update(kind, add=ids)[0]
+
+    def remove(self, kind, ids):
+        return self.update(kind, remove=ids)[1]
+
+    def replace(self, kind, ids):
+        """Make ids the whole allowlist; returns its new size"""
+        return self.replace_many({kind: ids})[kind]
+
+    def replace_many(self, lists):
+        """Replace several allowlists, {kind: ids}, in one transaction;
+        returns their new sizes by kind"""
+        lists = {kind: set(ids) for kind, ids in lists.items()}
+
+        def run(conn):
+            for kind, ids in lists.items():
+                conn.execute("DELETE FROM allowlist WHERE kind = ?", (kind,))
+                conn.executemany(
+                    "INSERT INTO allowlist (kind, id) VALUES (?, ?)",
+                    ((kind, x) for x in ids),
+                )
+            return {kind: len(ids) for kind, ids in lists.items()}
+
+        return self._transaction(run)
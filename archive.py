@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+SQLite message archive for Slack Exporter.
+
+Stores messages, thread replies, users, conversations and file metadata in
+indexed tables so exports can be rendered locally and only new messages have
+to be fetched from Slack. This module is storage only; exporter.py decides
+what to fetch (see sync_history and sync_replies there).
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from time import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    channel TEXT NOT NULL,
+    ts TEXT NOT NULL,
+    ts_num REAL NOT NULL,
+    thread_ts TEXT,
+    user TEXT,
+    text TEXT,
+    reply_count INTEGER,
+    latest_reply TEXT,
+    in_history INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL,
+    UNIQUE (channel, ts)
+);
+CREATE INDEX IF NOT EXISTS messages_history
+    ON messages (channel, in_history, ts_num);
+CREATE INDEX IF NOT EXISTS messages_thread
+    ON messages (channel, thread_ts, ts_num);
+
+CREATE TABLE IF NOT EXISTS threads (
+    channel TEXT NOT NULL,
+    thread_ts TEXT NOT NULL,
+    reply_count INTEGER,
+    latest_reply TEXT,
+    PRIMARY KEY (channel, thread_ts)
+);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    channel TEXT PRIMARY KEY,
+    latest_ts TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS channels (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS files (
+    id TEXT PRIMARY KEY,
+    user TEXT,
+    created INTEGER,
+    size INTEGER,
+    name TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_created ON files (created);
+"""
+
+# Full-text index over the messages table. It stores no copy of the text
+# (content='messages'); the triggers keep it in step with every insert,
+# edit and delete, so each export only indexes the messages it changed.
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (
+    text, user, channel,
+    content='messages', content_rowid='id'
+);
+
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+BEGIN
+    INSERT INTO messages_fts (rowid, text, user, channel)
+    VALUES (new.id, new.text, new.user, new.channel);
+END;
+
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, text, user, channel)
+    VALUES ('delete', old.id, old.text, old.user, old.channel);
+END;
+
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF text, user ON messages
+WHEN old.text IS NOT new.text OR old.user IS NOT new.user
+BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, text, user, channel)
+    VALUES ('delete', old.id, old.text, old.user, old.channel);
+    INSERT INTO messages_fts (rowid, text, user, channel)
+    VALUES (new.id, new.text, new.user, new.channel);
+END;
+"""
+
+# bm25 column weights for text, user and channel
+SEARCH_WEIGHTS = (10.0, 1.0, 1.0)
+
+
+class Archive:
+    """A Slack workspace archived in one SQLite file
+
+    Messages are keyed by (channel, ts). in_history marks messages returned by
+    conversations.history, as opposed to thread replies that only appear in
+    conversations.replies. The archive may be shared between threads.
+
+    If SQLite was built with FTS5, messages are also full-text indexed for
+    search(); otherwise self.searchable is False.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=30000")
+        with self._lock:
+            self._conn.executescript(SCHEMA)
+            self.searchable = self._create_search_index()
+
+    def _create_search_index(self):
+        """Create the FTS5 index, indexing messages archived before it existed"""
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'"
+        ).fetchone()
+        try:
+            self._conn.executescript(SEARCH_SCHEMA)
+        except sqlite3.OperationalError:
+            return False  # no FTS5 in this SQLite build
+        if not exists:
+            self._conn.execute(
+                "INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')"
+            )
+        return True
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """Hold the lock and a write transaction; nested uses join the
+        outermost one"""
+        with self._lock:
+            if self._conn.in_transaction:
+                yield
+                return
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _write(self, sql, rows):
+        """Run sql for every row in one transaction"""
+        with self._transaction():
+            self._conn.executemany(sql, rows)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # messages
+
+    def store_messages(self, channel, msgs, in_history=True):
+        """Insert or update messages of a channel
+
+        A message that was ever seen in the history keeps in_history set.
+        """
+        self._write(
+            """
+            INSERT INTO messages (channel, ts, ts_num, thread_ts, user, text,
+                                  reply_count, latest_reply, in_history, data)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (channel, ts) DO UPDATE SET
+                thread_ts = excluded.thread_ts,
+                user = excluded.user,
+                text = excluded.text,
+                reply_count = excluded.reply_count,
+                latest_reply = excluded.latest_reply,
+                in_history = MAX(in_history, excluded.in_history),
+                data = excluded.data
+            """,
+            (
+                (
+                    channel,
+                    msg["ts"],
+                    float(msg["ts"]),
+                    msg.get("thread_ts"),
+                    msg.get("user"),
+                    msg.get("text"),
+                    msg.get("reply_count"),
+                    msg.get("latest_reply"),
+                    1 if in_history else 0,
+                    json.dumps(msg),
+                )
+                for msg in msgs
+            ),
+        )
+
+    def history(self, channel, oldest=None, latest=None):
+        """The channel's history, newest first like conversations.history;
+        oldest and latest are exclusive bounds"""
+        sql = "SELECT data FROM messages WHERE channel = ? AND in_history = 1"
+        params = [channel]
+        if oldest is not None:
+            sql += " AND ts_num > ?"
+            params.append(float(oldest))
+        if latest is not None:
+            sql += " AND ts_num < ?"
+            params.append(float(latest))
+        sql += " ORDER BY ts_num DESC"
+        return [json.loads(data) for data, in self._query(sql, params)]
+
+    def thread(self, channel, thread_ts):
+        """A thread's parent and replies, oldest first like
+        conversations.replies"""
+        rows = self._query(
+            """
+            SELECT data FROM messages
+            WHERE channel = ? AND (thread_ts = ? OR ts = ?)
+            ORDER BY ts_num
+            """,
+            (channel, thread_ts, thread_ts),
+        )
+        return [json.loads(data) for data, in rows]
+
+    def count_messages(self, channel=None):
+        if channel is None:
+            return self._query("SELECT COUNT(*) FROM messages")[0][0]
+        return self._query(
+            "SELECT COUNT(*) FROM messages WHERE channel = ?", (channel,)
+        )[0][0]
+
+    # search
+
+    def search(self, query, channels=None, oldest=None, latest=None, limit=50):
+        """Messages matching an FTS5 query, best match first
+        (https://www.sqlite.org/fts5.html#full_text_query_syntax)
+
+        channels limits the search to those channel ids; oldest and latest
+        are inclusive bounds on ts. A query that is not valid FTS5 syntax is
+        searched for as plain words; with no words in it, nothing matches.
+        Each result is the message with
+        "channel" and a "snippet" of its text with the matches in **bold**.
+        """
+        if not self.searchable:
+            raise RuntimeError("This SQLite build has no FTS5, so search is unavailable")
+
+        sql = """
+            SELECT m.channel, m.data,
+                snippet(messages_fts, 0, '**', '**', '…', 16)
+            FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+            WHERE messages_fts MATCH ?"""
+        params = []
+        if channels:
+            sql += " AND m.channel IN (%s)" % ", ".join("?" * len(channels))
+            params.extend(channels)
+        if oldest is not None:
+            sql += " AND m.ts_num >= ?"
+            params.append(float(oldest))
+        if latest is not None:
+            sql += " AND m.ts_num <= ?"
+            params.append(float(latest))
+        sql += " ORDER BY bm25(messages_fts, %s, %s, %s) LIMIT ?" % SEARCH_WEIGHTS
+        params.append(limit)
+
+        try:
+            rows = self._query(sql, [query] + params)
+        except sqlite3.OperationalError:
+            words = plain_query(query)
+            if not words:
+                return []
+            rows = self._query(sql, [words] + params)
+
+        results = []
+        for channel, data, snippet in rows:
+            msg = json.loads(data)
+            msg["channel"] = channel
+            msg["snippet"] = snippet
+            results.append(msg)
+        return results
+
+    # sync bookkeeping
+
+    def latest_ts(self, channel):
+        """Newest ts up to which the channel's history is fully archived"""
+        rows = self._query(
+            "SELECT latest_ts FROM sync_state WHERE channel = ?", (channel,)
+        )
+        return rows[0][0] if rows else None
+
+    def set_latest_ts(self, channel, ts):
+        self._write(
+            """
+            INSERT INTO sync_state (channel, latest_ts, updated) VALUES (?, ?, ?)
+            ON CONFLICT (channel) DO UPDATE SET
+                latest_ts = excluded.latest_ts, updated = excluded.updated
+            """,
+            [(channel, ts, time())],
+        )
+
+    def stale_threads(self, channel, timestamps):
+        """The thread timestamps whose replies are not archived, or whose
+        parent now reports a different reply count or latest reply"""
+        fresh = {
+            ts
+            for ts, in self._query(
+                """
+                SELECT t.thread_ts FROM threads t
+                JOIN messages m ON m.channel = t.channel AND m.ts = t.thread_ts
+                WHERE t.channel = ?
+                    AND m.reply_count IS t.reply_count
+                    AND m.latest_reply IS t.latest_reply
+                """,
+                (channel,),
+            )
+        }
+        return [ts for ts in timestamps if ts not in fresh]
+
+    def store_thread(self, channel, thread_ts, msgs):
+        """Archive a fetched thread along with what its parent said about it
+
+        Both are written in one transaction, so the thread's bookkeeping never
+        disagrees with its archived messages.
+        """
+        parent = next((x for x in msgs if x["ts"] == thread_ts), {})
+        with self._transaction():
+            self.store_messages(channel, msgs, in_history=False)
+            self._write(
+                """
+                INSERT INTO threads (channel, thread_ts, reply_count, latest_reply)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (channel, thread_ts) DO UPDATE SET
+                    reply_count = excluded.reply_count,
+                    latest_reply = excluded.latest_reply
+                """,
+                [
+                    (
+                        channel,
+                        thread_ts,
+                        parent.get("reply_count"),
+                        parent.get("latest_reply"),
+                    )
+                ],
+            )
+
+    # workspace metadata
+
+    def store_users(self, users):
+        self._write(
+            "INSERT OR REPLACE INTO users (id, name, data) VALUES (?, ?, ?)",
+            ((x["id"], x.get("name"), json.dumps(x)) for x in users),
+        )
+
+    def users(self):
+        return [json.loads(data) for data, in self._query("SELECT data FROM users")]
+
+    def store_channels(self, channels):
+        self._write(
+            "INSERT OR REPLACE INTO channels (id, name, data) VALUES (?, ?, ?)",
+            ((x["id"], x.get("name"), json.dumps(x)) for x in channels),
+        )
+
+    def channels(self):
+        return [json.loads(data) for data, in self._query("SELECT data FROM channels")]
+
+    def store_files(self, files):
+        self._write(
+            """
+            INSERT OR REPLACE INTO files (id, user, created, size, name, data)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (
+                (
+                    x["id"],
+                    x.get("user"),
+                    x.get("created"),
+                    x.get("size"),
+                    x.get("name"),
+                    json.dumps(x),
+                )
+                for x in files
+            ),
+        )
+
+    def files(self):
+        rows = self._query("SELECT data FROM files ORDER BY created DESC")
+        return [json.loads(data) for data, in rows]
+
+
+# FTS5 operators, which are only operators in upper case
+FTS_OPERATORS = {"AND", "OR", "NOT", "NEAR"}
+
+
+def plain_query(query):
+    """An FTS5 query matching all the words of query, taken literally
+
+    Tokens without word characters (stray quotes, parentheses) and bare
+    operators are left out; an empty string means there is nothing to match.
+    """
+    words = [
+        x
+        for x in query.split()
+        if re.search(r"\w", x) and x not in FTS_OPERATORS
+    ]
+    return " ".join('"%s"' % word.replace('"', '""') for word in words)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+asyncio export engine for Slack Exporter.
+
+Async counterparts of exporter's get_at_cursor, paginated_get, channel_history
+and channel_replies, built on aiohttp so that many channel and thread fetches
+overlap on a single thread. They use the same token, rate limiter, pool size
+and timeouts as the synchronous functions and return the same data.
+"""
+
+import asyncio
+import json
+import sys
+from time import monotonic
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+import exporter
+
+
+def client_session():
+    """Create an aiohttp session sized like the synchronous connection pool"""
+    if aiohttp is None:
+        raise RuntimeError("The async engine requires aiohttp: pip install aiohttp")
+
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=exporter.HTTP_POOL_SIZE),
+        timeout=aiohttp.ClientTimeout(
+            sock_connect=exporter.HTTP_CONNECT_TIMEOUT,
+            sock_read=exporter.HTTP_READ_TIMEOUT,
+        ),
+    )
+
+
+def run(coro):
+    """Run a coroutine from synchronous code"""
+    return asyncio.run(coro)
+
+
+async def _with_session(session, func, *args, **kwargs):
+    if session is not None:
+        return await func(*args, session=session, **kwargs)
+    async with client_session() as session:
+        return await func(*args, session=session, **kwargs)
+
+
+async def get_data(url, params, session):
+    """Async get_data; returns (status, reason, json body or None)"""
+    method = exporter.api_method(url)
+    # aiohttp refuses None query values, requests silently drops them
+    params = {k: v for k, v in params.items() if v is not None}
+    attempt = 0
+
+    while True:
+        wait = exporter.rate_limiter.reserve(method)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        attempt += 1
+        started = monotonic()
+        try:
+            async with session.get(url, headers=exporter.HEADERS, params=params) as r:
+                body = await r.read()
+        except aiohttp.ClientError:
+            exporter.record_api_call(
+                method, "error", monotonic() - started, 0, params, attempt, wait
+            )
+            raise
+        exporter.record_api_call(
+            method, r.status, monotonic() - started, len(body), params, attempt, wait
+        )
+        if r.status != 429:
+            data = json.loads(body) if r.status == 200 else None
+            return r.status, r.reason, data
+        retry_after = int(r.headers.get("Retry-After", 1))  # seconds to wait
+
+        sleep_time = retry_after + exporter.ADDITIONAL_SLEEP_TIME
+        print(f"Rate-limited. Retrying after {sleep_time} seconds ({attempt}x).")
+        exporter.rate_limiter.backoff(method, sleep_time)
+
+
+# pagination handling
+
+
+async def get_at_cursor(url, params, cursor=None, response_url=None, session=None):
+    if session is None:
+        return await _with_session(
+            None, get_at_cursor, url, params, cursor=cursor, response_url=response_url
+        )
+
+    if cursor is not None:
+        params["cursor"] = cursor
+
+    status, reason, d = await get_data(url, params, session)
+
+    if status != 200:
+        exporter.handle_print("ERROR: %s %s" % (status, reason), response_url)
+        sys.exit(1)
+
+    try:
+        if d["ok"] is False:
+            exporter.handle_print("I encountered an error: %s" % d, response_url)
+            sys.exit(1)
+        exporter.API_PAGES.inc(method=exporter.api_method(url))
+
+        next_cursor = None
+        if "response_metadata" in d and "next_cursor" in d["response_metadata"]:
+            next_cursor = d["response_metadata"]["next_cursor"]
+            if str(next_cursor).strip() == "":
+                next_cursor = None
+
+        return next_cursor, d
+
+    except KeyError as e:
+        exporter.handle_print("Something went wrong: %s." % e, response_url)
+        return None, []
+
+
+async def paginated_get(
+    url, params, combine_key=None, response_url=None, session=None, journal=None
+):
+    if session is None:
+        return await _with_session(
+            None, paginated_get, url, params, combine_key, response_url, journal=journal
+        )
+
+    next_cursor = None
+    result = []
+    if journal is not None:
+        for items in journal.replay(url, params):
+            result.extend(items)
+        if journal.complete:
+            return result
+        next_cursor = journal.next_cursor
+
+    try:
+        while True:
+            next_cursor, data = await get_at_cursor(
+                url, params, cursor=next_cursor, response_url=response_url, session=session
+            )
+
+            try:
+                items = data if combine_key is None else data[combine_key]
+            except KeyError as e:
+                exporter.handle_print("Something went wrong: %s." % e, response_url)
+                sys.exit(1)
+
+            if journal is not None:
+                journal.append(items, next_cursor)
+            result.extend(items)
+
+            if next_cursor is None:
+                break
+    finally:
+        if journal is not None:
+            journal.close()
+
+    return result
+
+
+# GET requests
+
+
+async def channel_history(
+    channel_id, response_url=None, oldest=None, latest=None, session=None, journal=None
+):
+    params = {
+        "channel": channel_id,
+        "limit": 200,
+    }
+
+    if oldest is not None:
+        params["oldest"] = oldest
+    if latest is not None:
+        params["latest"] = latest
+
+    return await paginated_get(
+        "https://slack.com/api/conversations.history",
+        params,
+        combine_key="messages",
+        response_url=response_url,
+        session=session,
+        journal=journal,
+    )
+
+
+async def thread_replies(
+    timestamp, channel_id, response_url=None, session=None, journal=None
+):
+    params = {
+        "channel": channel_id,
+        "ts": timestamp,
+        "limit": 200,
+    }
+
+    return await paginated_get(
+        "https://slack.com/api/conversations.replies",
+        params,
+        combine_key="messages",
+        response_url=response_url,
+        session=session,
+        journal=journal,
+    )
+
+
+async def channel_replies(
+    timestamps,
+    channel_id,
+    response_url=None,
+    session=None,
+    concurrency=None,
+    journals=None,
+):
+    """Fetch all threads concurrently; results keep the order of timestamps
+
+    At most `concurrency` threads are in flight at once (default: the HTTP
+    pool size); the rate limiter still paces the actual requests.
+    """
+    if session is None:
+        return await _with_session(
+            None,
+            channel_replies,
+            timestamps,
+            channel_id,
+            response_url,
+            concurrency=concurrency,
+            journals=journals,
+        )
+
+    semaphore = asyncio.Semaphore(concurrency or exporter.HTTP_POOL_SIZE)
+
+    async def fetch(timestamp):
+        journal = journals.journal("replies-%s" % timestamp) if journals else None
+        async with semaphore:
+            return await thread_replies(
+                timestamp, channel_id, response_url, session, journal
+            )
+
+    return list(await asyncio.gather(*(fetch(ts) for ts in timestamps)))
@@ -1,10 +1,14 @@
 import os
+import threading
 import requests
 from flask import Flask, request, Response, jsonify
 from urllib.parse import urljoin
 from uuid import uuid4
-import json
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from time import monotonic
+from jobs import JobQueue
+import metrics
 
 # Import with error handling for deployment
 try:
@@ -23,6 +27,9 @@ except ImportError as e:
     
     def user_list(*args, **kwargs):
         return []
+
+    def cached_user_list(*args, **kwargs):
+        return []
     
     def channel_replies(*args, **kwargs):
         return []
@@ -30,8 +37,37 @@ except ImportError as e:
     def parse_replies(*args, **kwargs):
         return "Export functionality not available"
 
+    def write_channel_history(fh, *args, **kwargs):
+        fh.write("Export functionality not available")
+
+    def write_replies(fh, *args, **kwargs):
+        fh.write("Export functionality not available")
+
+    def iter_channel_history(*args, **kwargs):
+        return iter([])
+
+    def iter_channel_replies(*args, **kwargs):
+        return iter([])
+
+    def json_writer(fh, *args, **kwargs):
+        raise RuntimeError("Export functionality not available")
+
+    def output_extension(fmt):
+        return ".txt" if fmt == "text" else ".json"
+
+    COMPRESSION_EXTENSIONS = {}
+
+    def open_file(path, mode="r", encoding="utf-8"):
+        return open(path, mode, encoding=encoding)
+
+    def with_suffix(path, suffix):
+        return path + suffix
+
+    rate_limiter = None
+
 try:
     from config import is_user_allowed, is_channel_allowed, add_allowed_user, remove_allowed_user, add_allowed_channel, remove_allowed_channel, list_allowed_users, list_allowed_channels
+    from config import update_allowed_users, update_allowed_channels, replace_allowed_users, replace_allowed_channels
 except ImportError as e:
     print(f"Warning: Could not import config module: {e}")
     # Create dummy functions to prevent crashes
@@ -58,14 +94,265 @@ except ImportError as e:
     
     def list_allowed_channels():
         return []
+    
+    def update_allowed_users(add=(), remove=()):
+        return 0, 0
+    
+    def update_allowed_channels(add=(), remove=()):
+        return 0, 0
+    
+    def replace_allowed_users(user_ids):
+        return 0
+    
+    def replace_allowed_channels(channel_ids):
+        return 0
 
 app = Flask(__name__)
 load_dotenv(os.path.join(app.root_path, ".env"))
 
-# Health check endpoint for Render
+# Slash command argument -> output format; anything else gets indented JSON
+EXPORT_MODES = ("text", "json", "json-compact", "jsonl")
+# gzip, xz or bz2 to compress exports unless the command names one
+EXPORT_COMPRESSION = os.environ.get("EXPORT_COMPRESSION") or None
+
+
+def export_options(command_args):
+    """Output format and compression from slash command text such as
+    "text gzip" or "jsonl" """
+    export_mode, compression = "json", EXPORT_COMPRESSION
+    for arg in str(command_args).lower().split():
+        if arg in EXPORT_MODES:
+            export_mode = arg
+        elif arg in COMPRESSION_EXTENSIONS or arg == "none":
+            compression = None if arg == "none" else arg
+    return export_mode, compression
+
+
+def export_filename(prefix, export_mode, compression):
+    filename = "%s-%s%s" % (prefix, str(uuid4().hex)[:6], output_extension(export_mode))
+    if compression in COMPRESSION_EXTENSIONS:
+        filename += COMPRESSION_EXTENSIONS[compression]
+    return filename
+
+
+# exports are written under a name with this suffix (before any compression
+# extension) and renamed once complete
+EXPORT_PART_SUFFIX = ".part"
+
+
+def is_partial_export(filename):
+    return EXPORT_PART_SUFFIX[1:] in filename.split(".")[1:]
+
+
+@contextmanager
+def write_export(filepath):
+    """Open an export for writing; it only appears at filepath once written
+    in full, and a failed export leaves nothing behind in exports/"""
+    part_path = with_suffix(filepath, EXPORT_PART_SUFFIX)
+    try:
+        with open_file(part_path, mode="w") as f:
+            yield f
+        os.replace(part_path, filepath)
+    except BaseException:
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+        raise
+
+
+DOWNLOAD_MIMETYPES = {
+    ".txt": "text/plain",
+    ".jsonl": "application/x-ndjson",
+    ".gz": "application/gzip",
+    ".xz": "application/x-xz",
+    ".bz2": "application/x-bzip2",
+}
+
+# with ARCHIVE_PATH set, exports are rendered from a local SQLite archive and
+# only messages missing from it are fetched from Slack
+ARCHIVE_PATH = os.environ.get("ARCHIVE_PATH") or None
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive():
+    """The process's shared Archive, or None without ARCHIVE_PATH"""
+    global _archive
+    if ARCHIVE_PATH is None:
+        return None
+    with _archive_lock:
+        if _archive is None:
+            from archive import Archive
+
+            _archive = Archive(ARCHIVE_PATH)
+    return _archive
+
+
+def fetch_history(ch_id, response_url):
+    archive = get_archive()
+    if archive is None:
+        return channel_history(ch_id, response_url)
+    return archived_history(archive, ch_id, response_url)
+
+
+def history_pages(ch_id, response_url):
+    """The channel's history in pages, as they arrive from Slack, or in one
+    piece from the archive"""
+    if get_archive() is None:
+        return iter_channel_history(ch_id, response_url)
+    return [fetch_history(ch_id, response_url)]
+
+
+def fetch_replies(timestamps, ch_id, response_url):
+    """The reply threads of timestamps, in order, as an iterable"""
+    archive = get_archive()
+    if archive is None:
+        return iter_channel_replies(timestamps, ch_id, response_url=response_url)
+    return archived_replies(archive, timestamps, ch_id, response_url)
+
+
+# exports run in the background so slash commands are answered at once;
+# sized by EXPORT_WORKERS and EXPORT_QUEUE_SIZE
+export_jobs = JobQueue()
+
+
+EXPORT_DURATION = metrics.histogram(
+    "slack_export_duration_seconds",
+    "Time taken by completed exports, by slash command",
+    ("command",),
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+)
+EXPORT_MESSAGES = metrics.histogram(
+    "slack_export_messages",
+    "Messages in completed exports, by slash command",
+    ("command",),
+    buckets=(10, 100, 1000, 10000, 100000, 1000000),
+)
+EXPORTS = metrics.counter(
+    "slack_exports_total",
+    "Exports run, by slash command and outcome (completed or failed)",
+    ("command", "outcome"),
+)
+
+
+def exports_dir_usage():
+    """(files, bytes) in the exports directory; exports are deleted once
+    downloaded, so the finished files are the downloads still pending, while
+    bytes include exports still being written"""
+    files = size = 0
+    try:
+        with os.scandir(os.path.join(app.root_path, "exports")) as it:
+            for entry in it:
+                if entry.is_file():
+                    files += not is_partial_export(entry.name)
+                    size += entry.stat().st_size
+    except FileNotFoundError:
+        pass
+    return files, size
+
+
+metrics.gauge(
+    "slack_exports_pending_downloads",
+    "Finished exports waiting to be downloaded",
+    function=lambda: exports_dir_usage()[0],
+)
+metrics.gauge(
+    "slack_exports_directory_bytes",
+    "Size of the exports directory",
+    function=lambda: exports_dir_usage()[1],
+)
+metrics.gauge(
+    "slack_export_jobs_queued",
+    "Exports waiting for a worker",
+    function=lambda: export_jobs.stats()["queued"],
+)
+metrics.gauge(
+    "slack_export_jobs_running",
+    "Exports running now",
+    function=lambda: export_jobs.stats()["running"],
+)
+
+
+def queue_export(command, func, response_url, *args):
+    """Run func(response_url, *args) in the background, recording its duration
+    and the number of messages it returns under command; returns the reply to
+    the slash command"""
+
+    def run():
+        started = monotonic()
+        try:
+            num_msgs = func(response_url, *args)
+        except BaseException:
+            EXPORTS.inc(command=command, outcome="failed")
+            raise
+        EXPORTS.inc(command=command, outcome="completed")
+        EXPORT_DURATION.observe(monotonic() - started, command=command)
+        EXPORT_MESSAGES.observe(num_msgs or 0, command=command)
+
+    def report_failure(e):
+        if isinstance(e, SystemExit):
+            # the exporter has already posted the reason
+            post_response(response_url, "❌ Sorry, the export could not be finished.")
+        else:
+            post_response(response_url, f"❌ Sorry, the export failed: {e!r}")
+
+    if not export_jobs.submit(run, on_error=report_failure):
+        return Response(
+            "⏳ Too many exports are queued right now, please try again in a few minutes."
+        ), 200
+    return Response(), 200
+
+
+# /health reports the service as degraded while Slack has answered 429 within
+# the last HEALTH_RATE_LIMIT_WINDOW seconds, while requests wait more than
+# HEALTH_MAX_BACKLOG seconds for the rate limiter, or while the export queue
+# is full
+HEALTH_RATE_LIMIT_WINDOW = float(os.environ.get("HEALTH_RATE_LIMIT_WINDOW", 300))
+HEALTH_MAX_BACKLOG = float(os.environ.get("HEALTH_MAX_BACKLOG", 30))
+
+
+def degraded_reasons():
+    reasons = []
+    if rate_limiter is not None:
+        pressure = rate_limiter.pressure()
+        since = pressure["seconds_since_rate_limited"]
+        if since is not None and since < HEALTH_RATE_LIMIT_WINDOW:
+            reasons.append("rate_limited")
+        if pressure["backlog_seconds"] > HEALTH_MAX_BACKLOG:
+            reasons.append("rate_limit_backlog")
+    jobs = export_jobs.stats()
+    if jobs["queued"] >= jobs["max_queued"]:
+        reasons.append("export_queue_full")
+    return reasons
+
+
+metrics.gauge(
+    "slack_exporter_degraded",
+    "1 while /health reports the service as degraded",
+    function=lambda: 1 if degraded_reasons() else 0,
+)
+
+
+# Health check endpoint for Render; a degraded service still answers 200 so
+# that it is not restarted for waiting out Slack's rate limits
 @app.route("/health")
 def health_check():
-    return jsonify({"status": "healthy", "service": "slack-exporter"}), 200
+    reasons = degraded_reasons()
+    return jsonify({
+        "status": "degraded" if reasons else "healthy",
+        "service": "slack-exporter",
+        "degraded": bool(reasons),
+        "degraded_reasons": reasons,
+        "rate_limits": rate_limiter.pressure() if rate_limiter is not None else {},
+        "export_jobs": export_jobs.stats(),
+    }), 200
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Metrics in the Prometheus text format"""
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
 
 # Flask routes
 
@@ -94,22 +381,43 @@ def export_channel():
         post_response(response_url, f"❌ Access denied. Channel {ch_id} is not authorized for export.")
         return Response(), 200
 
+    # the download link has to be built while the request is available
+    return queue_export(
+        "export-channel",
+        export_channel_job,
+        response_url,
+        team_id,
+        team_domain,
+        ch_id,
+        ch_name,
+        command_args,
+        request.url_root,
+    )
+
+
+def export_channel_job(
+    response_url, team_id, team_domain, ch_id, ch_name, command_args, url_root
+):
     post_response(response_url, "Retrieving history for this channel...")
-    ch_hist = channel_history(ch_id, response_url)
 
-    export_mode = str(command_args).lower()
+    export_mode, compression = export_options(command_args)
 
     exports_subdir = "exports"
     exports_dir = os.path.join(app.root_path, exports_subdir)
-    file_ext = ".txt" if export_mode == "text" else ".json"
-    filename = "%s-ch_%s-%s%s" % (team_domain, ch_id, str(uuid4().hex)[:6], file_ext)
+    filename = export_filename(
+        "%s-ch_%s" % (team_domain, ch_id), export_mode, compression
+    )
     filepath = os.path.join(exports_dir, filename)
-    loc = urljoin(request.url_root, "download/%s" % filename)
+    loc = urljoin(url_root, "download/%s" % filename)
 
     if not os.path.isdir(exports_dir):
         os.makedirs(exports_dir, exist_ok=True)
 
-    with open(filepath, mode="w", encoding="utf-8") as f:
+    if export_mode == "text":
+        # the header needs the message count, so text is rendered at the end
+        ch_hist = fetch_history(ch_id, response_url)
+
+    with write_export(filepath) as f:
         if export_mode == "text":
             num_msgs = len(ch_hist)
             sep = "=" * 24
@@ -119,20 +427,22 @@ def export_channel():
                 num_msgs,
                 sep,
             )
-            data_ch = header_str + parse_channel_history(
-                ch_hist, user_list(team_id, response_url)
-            )
-            f.write(data_ch)
+            f.write(header_str)
+            write_channel_history(f, ch_hist, cached_user_list(team_id, response_url))
         else:
-            json.dump(ch_hist, f, indent=4, ensure_ascii=False)
+            # JSON formats are written page by page as the history arrives
+            writer = json_writer(f, export_mode, ensure_ascii=False)
+            for page in history_pages(ch_id, response_url):
+                writer.write_all(page)
+            writer.close()
+            num_msgs = writer.count
 
     post_response(
         response_url,
         "Done! This channel's history is available for download here (note that this link "
         "is single-use): %s" % loc,
     )
-
-    return Response(), 200
+    return num_msgs
 
 
 @app.route("/slack/events/export-replies", methods=["POST"])
@@ -160,49 +470,63 @@ def export_replies():
         post_response(response_url, f"❌ Access denied. Channel {ch_id} is not authorized for export.")
         return Response(), 200
 
-    post_response(response_url, "Retrieving reply threads for this channel...")
-    print(ch_id)
-    ch_hist = channel_history(ch_id, response_url)
-    print(ch_hist)
-    ch_replies = channel_replies(
-        [x["ts"] for x in ch_hist if "reply_count" in x],
+    return queue_export(
+        "export-replies",
+        export_replies_job,
+        response_url,
+        team_id,
+        team_domain,
         ch_id,
-        response_url=response_url,
+        ch_name,
+        command_args,
+        request.url_root,
     )
 
-    export_mode = str(command_args).lower()
+
+def export_replies_job(
+    response_url, team_id, team_domain, ch_id, ch_name, command_args, url_root
+):
+    post_response(response_url, "Retrieving reply threads for this channel...")
+    ch_hist = fetch_history(ch_id, response_url)
+    reply_timestamps = [x["ts"] for x in ch_hist if "reply_count" in x]
+
+    export_mode, compression = export_options(command_args)
 
     exports_subdir = "exports"
     exports_dir = os.path.join(app.root_path, exports_subdir)
-    file_ext = ".txt" if export_mode == "text" else ".json"
-    filename = "%s-re_%s-%s%s" % (team_domain, ch_id, str(uuid4().hex)[:6], file_ext)
+    filename = export_filename(
+        "%s-re_%s" % (team_domain, ch_id), export_mode, compression
+    )
     filepath = os.path.join(exports_dir, filename)
-    loc = urljoin(request.url_root, "download/%s" % filename)
-
-    if export_mode == "text":
-        header_str = "Threads in: %s\n%s Messages" % (ch_name, len(ch_replies))
-        data_replies = parse_replies(ch_replies, user_list(team_id, response_url))
-        sep = "=" * 24
-        data_replies = "%s\n%s\n\n%s" % (header_str, sep, data_replies)
-    else:
-        data_replies = ch_replies
+    loc = urljoin(url_root, "download/%s" % filename)
 
     if not os.path.isdir(exports_dir):
         os.makedirs(exports_dir, exist_ok=True)
 
-    with open(filepath, mode="w", encoding="utf-8") as f:
+    if export_mode == "text":
+        ch_replies = list(fetch_replies(reply_timestamps, ch_id, response_url))
+
+    num_msgs = 0
+    with write_export(filepath) as f:
         if export_mode == "text":
-            f.write(data_replies)
+            header_str = "Threads in: %s\n%s Messages" % (ch_name, len(ch_replies))
+            sep = "=" * 24
+            f.write("%s\n%s\n\n" % (header_str, sep))
+            write_replies(f, ch_replies, cached_user_list(team_id, response_url))
+            num_msgs = sum(len(thread) for thread in ch_replies)
         else:
-            json.dump(data_replies, f, indent=4, ensure_ascii=False)
+            writer = json_writer(f, export_mode, ensure_ascii=False)
+            for thread in fetch_replies(reply_timestamps, ch_id, response_url):
+                writer.write_thread(thread)
+                num_msgs += len(thread)
+            writer.close()
 
     post_response(
         response_url,
         "Done! This channel's reply threads are available for download here (note that this "
         "link is single-use): %s" % loc,
     )
-
-    return Response(), 200
+    return num_msgs
 
 
 @app.route("/download/<filename>")
@@ -213,16 +537,17 @@ def download(filename):
     if ".." in filename or "/" in filename or "\\" in filename:
         return Response("Invalid filename", status=400)
 
-    if not os.path.exists(path):
+    if is_partial_export(filename) or not os.path.exists(path):
         return Response("File not found", status=404)
 
     def generate():
-        with open(path, encoding="utf-8") as f:
-            yield from f
+        # compressed exports are sent as they are, so read raw bytes
+        with open(path, "rb") as f:
+            yield from iter(lambda: f.read(1 << 16), b"")
         os.remove(path)
 
-    mimetype = (
-        "text/plain" if os.path.splitext(filename)[-1] == ".txt" else "application/json"
+    mimetype = DOWNLOAD_MIMETYPES.get(
+        os.path.splitext(filename)[-1], "application/json"
     )
 
     r = app.response_class(generate(), mimetype=mimetype)
@@ -262,6 +587,52 @@ def add_user():
         }), 400
 
 
+def id_list(data, key):
+    """The list of ID strings at data[key] (missing means empty), or None if
+    it is not one"""
+    if not isinstance(data, dict):
+        return None
+    ids = data.get(key, [])
+    if not isinstance(ids, list) or not all(isinstance(x, str) for x in ids):
+        return None
+    return ids
+
+
+@app.route("/admin/users/bulk", methods=["POST"])
+def bulk_update_users():
+    """Add and remove many users at once: {"add": [...], "remove": [...]}"""
+    data = request.get_json(silent=True)
+    add, remove = id_list(data, "add"), id_list(data, "remove")
+    if add is None or remove is None:
+        return jsonify({"error": "add and remove must be lists of user IDs"}), 400
+    
+    try:
+        added, removed = update_allowed_users(add=add, remove=remove)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return jsonify({
+        "success": True,
+        "added": added,
+        "removed": removed,
+        "count": len(list_allowed_users())
+    })
+
+
+@app.route("/admin/users", methods=["PUT"])
+def replace_users():
+    """Replace the whole allowed users list: {"user_ids": [...]}"""
+    data = request.get_json(silent=True)
+    user_ids = id_list(data, "user_ids")
+    if user_ids is None or "user_ids" not in data:
+        return jsonify({"error": "user_ids must be a list of user IDs"}), 400
+    
+    try:
+        count = replace_allowed_users(user_ids)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return jsonify({"success": True, "count": count})
+
+
 @app.route("/admin/users/<user_id>", methods=["DELETE"])
 def remove_user(user_id):
     """Remove a user from the allowed list"""
@@ -309,6 +680,41 @@ def add_channel():
         }), 400
 
 
+@app.route("/admin/channels/bulk", methods=["POST"])
+def bulk_update_channels():
+    """Add and remove many channels at once: {"add": [...], "remove": [...]}"""
+    data = request.get_json(silent=True)
+    add, remove = id_list(data, "add"), id_list(data, "remove")
+    if add is None or remove is None:
+        return jsonify({"error": "add and remove must be lists of channel IDs"}), 400
+    
+    try:
+        added, removed = update_allowed_channels(add=add, remove=remove)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return jsonify({
+        "success": True,
+        "added": added,
+        "removed": removed,
+        "count": len(list_allowed_channels())
+    })
+
+
+@app.route("/admin/channels", methods=["PUT"])
+def replace_channels():
+    """Replace the whole allowed channels list: {"channel_ids": [...]}"""
+    data = request.get_json(silent=True)
+    channel_ids = id_list(data, "channel_ids")
+    if channel_ids is None or "channel_ids" not in data:
+        return jsonify({"error": "channel_ids must be a list of channel IDs"}), 400
+    
+    try:
+        count = replace_allowed_channels(channel_ids)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return jsonify({"success": True, "count": count})
+
+
 @app.route("/admin/channels/<channel_id>", methods=["DELETE"])
 def remove_channel(channel_id):
     """Remove a channel from the allowed list"""
@@ -328,11 +734,13 @@ def remove_channel(channel_id):
 @app.route("/admin/status", methods=["GET"])
 def admin_status():
     """Get overall status of access control"""
+    users = list_allowed_users()
+    channels = list_allowed_channels()
     return jsonify({
-        "allowed_users": list_allowed_users(),
-        "allowed_channels": list_allowed_channels(),
-        "user_count": len(list_allowed_users()),
-        "channel_count": len(list_allowed_channels())
+        "allowed_users": users,
+        "allowed_channels": channels,
+        "user_count": len(users),
+        "channel_count": len(channels)
     })
 
 
@@ -1,8 +1,9 @@
 import os
-import json
-from typing import Set, List
+from typing import Iterable, Set, List, Tuple
 from dotenv import load_dotenv
 
+from access_store import AllowlistStore
+
 # Load environment variables
 load_dotenv()
 
@@ -14,41 +15,35 @@ ALLOWED_CHANNELS_FILE = os.path.join(CONFIG_DIR, "allowed_channels.json")
 # Ensure config directory exists
 os.makedirs(CONFIG_DIR, exist_ok=True)
 
-def load_json_file(filepath: str, default: List = None) -> Set[str]:
-    """Load a JSON file containing a list of strings, return as a set"""
-    if default is None:
-        default = []
-    
-    try:
-        if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return set(data.get('items', default))
-        else:
-            # Create file with default data
-            save_json_file(filepath, default)
-            return set(default)
-    except (json.JSONDecodeError, IOError) as e:
-        print(f"Error loading {filepath}: {e}")
-        return set(default)
-
-def save_json_file(filepath: str, items: List[str]) -> bool:
-    """Save a list of strings to a JSON file"""
-    try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump({'items': list(items)}, f, indent=2, ensure_ascii=False)
-        return True
-    except IOError as e:
-        print(f"Error saving {filepath}: {e}")
-        return False
+# Allowlists live in a SQLite store; the JSON files above are imported into
+# it once by AllowlistStore and not read afterwards
+ACCESS_DB_FILE = os.path.join(CONFIG_DIR, "access.db")
+USERS = "users"
+CHANNELS = "channels"
+
+_store = AllowlistStore(
+    ACCESS_DB_FILE,
+    legacy_files={USERS: ALLOWED_USERS_FILE, CHANNELS: ALLOWED_CHANNELS_FILE},
+)
+
+def _check_ids(ids: Iterable[str], prefix: str, what: str) -> List[str]:
+    """Return ids as a list, or raise ValueError if any is malformed"""
+    ids = [x.strip() for x in ids]
+    invalid = [x for x in ids if not x.startswith(prefix)]
+    if invalid:
+        raise ValueError(
+            f"Invalid {what} ID format: {', '.join(invalid[:10])}"
+            f"{' ...' if len(invalid) > 10 else ''}. Must start with '{prefix}'"
+        )
+    return ids
 
 def get_allowed_users() -> Set[str]:
     """Get the set of allowed user IDs"""
-    return load_json_file(ALLOWED_USERS_FILE, default=[])
+    return set(_store.items(USERS))
 
 def get_allowed_channels() -> Set[str]:
     """Get the set of allowed channel IDs"""
-    return load_json_file(ALLOWED_CHANNELS_FILE, default=[])
+    return set(_store.items(CHANNELS))
 
 def add_allowed_user(user_id: str) -> bool:
     """Add a user ID to the allowed users list"""
@@ -56,17 +51,12 @@ def add_allowed_user(user_id: str) -> bool:
         print(f"Invalid user ID format: {user_id}. Must start with 'U'")
         return False
     
-    users = get_allowed_users()
-    users.add(user_id)
-    return save_json_file(ALLOWED_USERS_FILE, list(users))
+    _store.add(USERS, [user_id])
+    return True
 
 def remove_allowed_user(user_id: str) -> bool:
     """Remove a user ID from the allowed users list"""
-    users = get_allowed_users()
-    if user_id in users:
-        users.remove(user_id)
-        return save_json_file(ALLOWED_USERS_FILE, list(users))
-    return False
+    return _store.remove(USERS, [user_id]) > 0
 
 def add_allowed_channel(channel_id: str) -> bool:
     """Add a channel ID to the allowed channels list"""
@@ -74,45 +64,70 @@ def add_allowed_channel(channel_id: str) -> bool:
         print(f"Invalid channel ID format: {channel_id}. Must start with 'C'")
         return False
     
-    channels = get_allowed_channels()
-    channels.add(channel_id)
-    return save_json_file(ALLOWED_CHANNELS_FILE, list(channels))
+    _store.add(CHANNELS, [channel_id])
+    return True
 
 def remove_allowed_channel(channel_id: str) -> bool:
     """Remove a channel ID from the allowed channels list"""
-    channels = get_allowed_channels()
-    if channel_id in channels:
-        channels.remove(channel_id)
-        return save_json_file(ALLOWED_CHANNELS_FILE, list(channels))
-    return False
+    return _store.remove(CHANNELS, [channel_id]) > 0
+
+def update_allowed_users(add: Iterable[str] = (), remove: Iterable[str] = ()) -> Tuple[int, int]:
+    """Add and remove user IDs in one transaction; returns how many were
+    (added, removed). Raises ValueError, changing nothing, if an ID to add is
+    malformed."""
+    return _store.update(USERS, _check_ids(add, 'U', "user"), [x.strip() for x in remove])
+
+def update_allowed_channels(add: Iterable[str] = (), remove: Iterable[str] = ()) -> Tuple[int, int]:
+    """Add and remove channel IDs in one transaction; returns how many were
+    (added, removed). Raises ValueError, changing nothing, if an ID to add is
+    malformed."""
+    return _store.update(CHANNELS, _check_ids(add, 'C', "channel"), [x.strip() for x in remove])
+
+def replace_allowed_users(user_ids: Iterable[str]) -> int:
+    """Make user_ids the whole allowed users list; returns its size"""
+    return _store.replace(USERS, _check_ids(user_ids, 'U', "user"))
+
+def replace_allowed_channels(channel_ids: Iterable[str]) -> int:
+    """Make channel_ids the whole allowed channels list; returns its size"""
+    return _store.replace(CHANNELS, _check_ids(channel_ids, 'C', "channel"))
+
+def replace_allowlists(user_ids: Iterable[str], channel_ids: Iterable[str]) -> Tuple[int, int]:
+    """Make user_ids and channel_ids the whole allowlists in one transaction;
+    returns their (users, channels) sizes. Raises ValueError, changing
+    nothing, if an ID is malformed."""
+    sizes = _store.replace_many({
+        USERS: _check_ids(user_ids, 'U', "user"),
+        CHANNELS: _check_ids(channel_ids, 'C', "channel"),
+    })
+    return sizes[USERS], sizes[CHANNELS]
 
 def is_user_allowed(user_id: str) -> bool:
     """Check if a user ID is in the allowed users list"""
-    allowed_users = get_allowed_users()
-    return user_id in allowed_users
+    return _store.contains(USERS, user_id)
 
 def is_channel_allowed(channel_id: str) -> bool:
     """Check if a channel ID is in the allowed channels list"""
-    allowed_channels = get_allowed_channels()
-    return channel_id in allowed_channels
+    return _store.contains(CHANNELS, channel_id)
 
 def list_allowed_users() -> List[str]:
     """Get a list of all allowed user IDs"""
-    return sorted(list(get_allowed_users()))
+    return sorted(_store.items(USERS))
 
 def list_allowed_channels() -> List[str]:
     """Get a list of all allowed channel IDs"""
-    return sorted(list(get_allowed_channels()))
+    return sorted(_store.items(CHANNELS))
 
 def clear_allowed_users() -> bool:
     """Clear all allowed users"""
-    return save_json_file(ALLOWED_USERS_FILE, [])
+    _store.replace(USERS, [])
+    return True
 
 def clear_allowed_channels() -> bool:
     """Clear all allowed channels"""
-    return save_json_file(ALLOWED_CHANNELS_FILE, [])
+    _store.replace(CHANNELS, [])
+    return True
 
-# Initialize with example data if files don't exist
+# Initialize with example data if the allowlists are empty
 def initialize_example_data():
     """Initialize with example user and channel if no data exists"""
     users = get_allowed_users()
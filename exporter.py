@@ -3,12 +3,27 @@ import os
 import sys
 import requests
 import json
+import io
+import re
+import gzip
+import bz2
+import lzma
+import hashlib
+import shutil
+import glob
 from timeit import default_timer
 from datetime import datetime
 import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 from pathvalidate import sanitize_filename
-from time import sleep
+from time import sleep, monotonic, thread_time, time
+from contextlib import contextmanager
+
+import metrics
 
 # Import access control functions
 try:
@@ -27,16 +42,89 @@ except ImportError:
 # when rate-limited, add this to the wait time
 ADDITIONAL_SLEEP_TIME = 2
 
+# HTTP connection pooling; all Slack traffic shares one keep-alive session
+HTTP_POOL_SIZE = int(os.environ.get("SLACK_HTTP_POOL_SIZE", 16))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("SLACK_HTTP_CONNECT_TIMEOUT", 10))
+HTTP_READ_TIMEOUT = float(os.environ.get("SLACK_HTTP_READ_TIMEOUT", 60))
+
+# Slack Web API rate limit tiers in requests per minute,
+# see https://api.slack.com/docs/rate-limits
+RATE_LIMIT_TIERS = {1: 1, 2: 20, 3: 50, 4: 100}
+METHOD_TIERS = {
+    "conversations.history": 3,
+    "conversations.replies": 3,
+    "conversations.list": 2,
+    "users.list": 2,
+    "files.list": 3,
+}
+DEFAULT_METHOD_TIER = 3
+# threads fetched concurrently by channel_replies
+REPLY_WORKERS = int(os.environ.get("SLACK_REPLY_WORKERS", 4))
+
+# fraction of each method's budget we use, to stay just under the limit
+RATE_LIMIT_HEADROOM = float(os.environ.get("SLACK_RATE_LIMIT_HEADROOM", 0.9))
+# requests a method may send back-to-back before pacing kicks in
+RATE_LIMIT_BURST = int(os.environ.get("SLACK_RATE_LIMIT_BURST", 3))
+
 env_file = os.path.join(os.path.dirname(__file__), ".env")
 if os.path.isfile(env_file):
     load_dotenv(env_file)
 
 
+# http session handling
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def configure_session(pool_size=None, connect_timeout=None, read_timeout=None):
+    """Change pool size and timeouts; the session is rebuilt on next use"""
+    global HTTP_POOL_SIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, _session
+
+    with _session_lock:
+        if pool_size is not None:
+            HTTP_POOL_SIZE = pool_size
+        if connect_timeout is not None:
+            HTTP_CONNECT_TIMEOUT = connect_timeout
+        if read_timeout is not None:
+            HTTP_READ_TIMEOUT = read_timeout
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def get_session():
+    """Return the shared requests.Session, creating it on first use.
+
+    The session is created lazily so that every gunicorn worker builds its own
+    pool after forking. pool_block makes threads wait for a free connection
+    instead of opening throwaway ones beyond HTTP_POOL_SIZE.
+    """
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_SIZE,
+                pool_maxsize=HTTP_POOL_SIZE,
+                pool_block=True,
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def http_timeout():
+    return (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+
 # write handling
 
 
 def post_response(response_url, text):
-    requests.post(response_url, json={"text": text})
+    get_session().post(response_url, json={"text": text}, timeout=http_timeout())
 
 
 # use this to say anything
@@ -62,29 +150,430 @@ except KeyError:
     sys.exit(1)
 
 
+# metrics (see metrics.py); bot.py serves them at /metrics
+
+API_REQUESTS = metrics.counter(
+    "slack_api_requests_total",
+    "Slack Web API requests by method and HTTP status",
+    ("method", "status"),
+)
+API_LATENCY = metrics.histogram(
+    "slack_api_request_duration_seconds",
+    "Slack Web API response time by method",
+    ("method",),
+)
+API_RESPONSE_BYTES = metrics.counter(
+    "slack_api_response_bytes_total",
+    "Bytes received from the Slack Web API by method",
+    ("method",),
+)
+API_PAGES = metrics.counter(
+    "slack_api_pages_total",
+    "Result pages fetched by method",
+    ("method",),
+)
+API_RATE_LIMITED = metrics.counter(
+    "slack_api_rate_limited_total",
+    "HTTP 429 responses from the Slack Web API by method",
+    ("method",),
+)
+API_SLEEP = metrics.counter(
+    "slack_api_sleep_seconds_total",
+    "Seconds requests waited for the rate limiter, including Retry-After back-off",
+    ("method",),
+)
+
+
+def record_api_call(method, status, seconds, nbytes, params=None, attempt=1, slept=0.0):
+    """Count one Slack API response in the metrics, and in the --trace log
+
+    attempt is 1 for the first try of a request and slept the seconds it
+    waited for the rate limiter before being sent.
+    """
+    API_REQUESTS.inc(method=method, status=status)
+    API_LATENCY.observe(seconds, method=method)
+    API_RESPONSE_BYTES.inc(nbytes, method=method)
+    if status == 429:
+        API_RATE_LIMITED.inc(method=method)
+    if api_trace is not None:
+        api_trace.write(
+            {
+                "time": time(),
+                "method": method,
+                "params": {
+                    k: v
+                    for k, v in (params or {}).items()
+                    if v is not None and k not in TRACE_OMITTED_PARAMS
+                },
+                "status": status,
+                "latency": seconds,
+                "bytes": nbytes,
+                "retries": attempt - 1,
+                "sleep": slept,
+                "thread": threading.current_thread().name,
+            }
+        )
+
+
+# request parameters left out of --trace records
+TRACE_OMITTED_PARAMS = frozenset(["token"])
+
+
+class TraceLog:
+    """JSON Lines file with one record per Slack API call (--trace)
+
+    Lines are flushed as they are written, so the log is complete up to the
+    last call even if the export is interrupted.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = 0
+        self._fh = open(path, mode="w", encoding="utf-8", buffering=1)
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self._fh.write(line)
+            self.records += 1
+
+    def close(self):
+        with self._lock:
+            self._fh.close()
+
+
+# the TraceLog of --trace, or None
+api_trace = None
+
+
+class Profiler:
+    """Wall and CPU time per channel, split into phases (--profile)
+
+    Times are exclusive: a phase entered while another is running is not
+    counted in the outer one, so e.g. fetching the next page while rendering
+    a stream counts as fetch. CPU time is that of the exporting thread only.
+    When disabled, every method is a cheap no-op.
+    """
+
+    PHASES = ("fetch", "render", "write")
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._totals = {}  # channel -> phase -> [wall, cpu]
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def channel(self, channel_id):
+        """Attribute the phases run inside to channel_id"""
+        previous = getattr(self._local, "channel", None)
+        self._local.channel = channel_id
+        try:
+            yield
+        finally:
+            self._local.channel = previous
+
+    @contextmanager
+    def phase(self, name):
+        channel = getattr(self._local, "channel", None)
+        if not self.enabled or channel is None:
+            yield
+            return
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        frame = [0.0, 0.0]  # time spent in nested phases
+        stack.append(frame)
+        wall, cpu = monotonic(), thread_time()
+        try:
+            yield
+        finally:
+            wall, cpu = monotonic() - wall, thread_time() - cpu
+            stack.pop()
+            if stack:
+                stack[-1][0] += wall
+                stack[-1][1] += cpu
+            with self._lock:
+                totals = self._totals.setdefault(channel, {})
+                entry = totals.setdefault(name, [0.0, 0.0])
+                entry[0] += wall - frame[0]
+                entry[1] += cpu - frame[1]
+
+    def iterate(self, name, iterable):
+        """Yield from iterable, timing each step as phase name"""
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def writer(self, fh):
+        """fh, with its writes timed as the "write" phase"""
+        return _ProfiledWriter(fh, self) if self.enabled else fh
+
+    def stats(self):
+        with self._lock:
+            return {
+                channel: {name: tuple(v) for name, v in phases.items()}
+                for channel, phases in self._totals.items()
+            }
+
+    def report(self):
+        stats = self.stats()
+        if not stats:
+            return "Profile: nothing exported"
+        totals = {}
+        for phases in stats.values():
+            for name, (wall, cpu) in phases.items():
+                entry = totals.setdefault(name, [0.0, 0.0])
+                entry[0] += wall
+                entry[1] += cpu
+        width = max(len("channel"), max(len(x) for x in stats))
+        lines = [
+            "Profile (wall / CPU seconds):",
+            " ".join(
+                ["channel".ljust(width)]
+                + [x.rjust(17) for x in self.PHASES + ("total",)]
+            ),
+        ]
+        for channel, phases in sorted(stats.items()) + [("all", totals)]:
+            cells = [tuple(phases.get(x, (0.0, 0.0))) for x in self.PHASES]
+            cells.append((sum(c[0] for c in cells), sum(c[1] for c in cells)))
+            lines.append(
+                " ".join(
+                    [channel.ljust(width)]
+                    + [("%.3f / %.3f" % cell).rjust(17) for cell in cells]
+                )
+            )
+        return "\n".join(lines)
+
+
+class _ProfiledWriter:
+    def __init__(self, fh, profiler):
+        self._fh = fh
+        self._profiler = profiler
+
+    def write(self, data):
+        with self._profiler.phase("write"):
+            return self._fh.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._fh, name)
+
+
+# the Profiler of --profile; disabled unless asked for
+profiler = Profiler(enabled=False)
+
+
+# rate limiting
+
+
+class MethodBudget:
+    """Token bucket for a single Web API method, shared by all threads.
+
+    Implemented as a virtual schedule: each request reserves the next free
+    slot, so concurrent callers queue up evenly instead of bursting together.
+    """
+
+    def __init__(self, method, limit, headroom=RATE_LIMIT_HEADROOM, burst=RATE_LIMIT_BURST):
+        self.method = method
+        self.limit = limit  # Slack's limit, requests per minute
+        self.interval = 60.0 / (limit * headroom)
+        self.burst = max(burst, 1)
+        self.tolerance = self.interval * (self.burst - 1)
+        self.requests = 0
+        self.rate_limited = 0
+        self.paced_seconds = 0.0
+        self.retry_after_seconds = 0.0
+        self.last_rate_limited = None  # monotonic time of the last 429
+        self._tat = 0.0  # theoretical arrival time of the next request
+        self._first = None
+        self._last = None
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Claim the next request slot, return seconds to wait before sending"""
+        with self._lock:
+            now = monotonic()
+            tat = max(self._tat, now)
+            wait = max(0.0, tat - self.tolerance - now)
+            self._tat = tat + self.interval
+            self.requests += 1
+            self.paced_seconds += wait
+            if self._first is None:
+                self._first = now + wait
+            self._last = now + wait
+            return wait
+
+    def backoff(self, seconds):
+        """Hold back every caller for the given seconds after a 429"""
+        with self._lock:
+            self.rate_limited += 1
+            self.retry_after_seconds += seconds
+            self.last_rate_limited = monotonic()
+            self._tat = max(self._tat, self.last_rate_limited + seconds + self.tolerance)
+
+    def backlog(self):
+        """Seconds a request sent now would wait for its slot"""
+        with self._lock:
+            return max(0.0, self._tat - self.tolerance - monotonic())
+
+    def utilisation(self):
+        """Requests sent as a fraction of what Slack's limit allowed so far"""
+        with self._lock:
+            if self._first is None:
+                return 0.0
+            span = self._last - self._first
+            allowed = self.burst + span * self.limit / 60.0
+            return self.requests / allowed
+
+
+class RateLimiter:
+    """Paces Web API calls to stay under each method's tier budget"""
+
+    def __init__(self, headroom=RATE_LIMIT_HEADROOM, burst=RATE_LIMIT_BURST):
+        self.headroom = headroom
+        self.burst = burst
+        self._budgets = {}
+        self._lock = threading.Lock()
+
+    def budget(self, method):
+        with self._lock:
+            if method not in self._budgets:
+                tier = METHOD_TIERS.get(method, DEFAULT_METHOD_TIER)
+                self._budgets[method] = MethodBudget(
+                    method, RATE_LIMIT_TIERS[tier], self.headroom, self.burst
+                )
+            return self._budgets[method]
+
+    def reserve(self, method):
+        wait = self.budget(method).reserve()
+        if wait > 0:
+            API_SLEEP.inc(wait, method=method)
+        return wait
+
+    def acquire(self, method):
+        """Block until a request to the method may be sent"""
+        wait = self.reserve(method)
+        if wait > 0:
+            sleep(wait)
+        return wait
+
+    def backoff(self, method, seconds):
+        self.budget(method).backoff(seconds)
+
+    def configure(self, headroom=None, burst=None):
+        """Change pacing for budgets created from now on"""
+        with self._lock:
+            if headroom is not None:
+                self.headroom = headroom
+            if burst is not None:
+                self.burst = burst
+            self._budgets = {}
+
+    def stats(self):
+        with self._lock:
+            budgets = list(self._budgets.values())
+        return {
+            b.method: {
+                "requests": b.requests,
+                "limit_per_minute": b.limit,
+                "utilisation": b.utilisation(),
+                "paced_seconds": b.paced_seconds,
+                "rate_limited": b.rate_limited,
+                "retry_after_seconds": b.retry_after_seconds,
+            }
+            for b in budgets
+        }
+
+    def pressure(self):
+        """How hard the rate limits are holding us back right now: the longest
+        wait for a request slot of any method, and the seconds since Slack
+        last answered 429 (None if it never did)"""
+        with self._lock:
+            budgets = list(self._budgets.values())
+        limited = [b.last_rate_limited for b in budgets if b.last_rate_limited]
+        return {
+            "backlog_seconds": max([b.backlog() for b in budgets], default=0.0),
+            "seconds_since_rate_limited": (
+                monotonic() - max(limited) if limited else None
+            ),
+        }
+
+    def report(self):
+        lines = []
+        for method, st in sorted(self.stats().items()):
+            lines.append(
+                "%s: %i requests, %.0f%% of %i/min limit, paced %.1fs, "
+                "rate-limited %ix (%.1fs)"
+                % (
+                    method,
+                    st["requests"],
+                    st["utilisation"] * 100,
+                    st["limit_per_minute"],
+                    st["paced_seconds"],
+                    st["rate_limited"],
+                    st["retry_after_seconds"],
+                )
+            )
+        return "\n".join(lines)
+
+
+rate_limiter = RateLimiter()
+
+
+def api_method(url):
+    return url.rstrip("/").rsplit("/", 1)[-1]
+
+
 def _get_data(url, params):
-    return requests.get(url, headers=HEADERS, params=params)
+    return get_session().get(url, headers=HEADERS, params=params, timeout=http_timeout())
 
 
 def get_data(url, params):
-    """Naively deals with rate-limiting"""
+    """Paces requests to stay under the method's rate limit
 
-    # success means "not rate-limited", it can still end up with error
-    success = False
+    Retry-After is still honoured as a backstop if Slack rate-limits us anyway;
+    the back-off applies to every thread using the same method.
+    """
+    method = api_method(url)
     attempt = 0
 
-    while not success:
-        r = _get_data(url, params)
+    while True:
+        slept = rate_limiter.acquire(method)
         attempt += 1
+        started = monotonic()
+        try:
+            r = _get_data(url, params)
+        except requests.RequestException:
+            record_api_call(
+                method, "error", monotonic() - started, 0, params, attempt, slept
+            )
+            raise
+        record_api_call(
+            method,
+            r.status_code,
+            monotonic() - started,
+            len(r.content),
+            params,
+            attempt,
+            slept,
+        )
 
         if r.status_code != 429:
-            success = True
-        else:
-            retry_after = int(r.headers["Retry-After"])  # seconds to wait
-            sleep_time = retry_after + ADDITIONAL_SLEEP_TIME
-            print(f"Rate-limited. Retrying after {sleep_time} seconds ({attempt}x).")
-            sleep(sleep_time)
-    return r
+            return r
+
+        retry_after = int(r.headers.get("Retry-After", 1))  # seconds to wait
+        sleep_time = retry_after + ADDITIONAL_SLEEP_TIME
+        print(f"Rate-limited. Retrying after {sleep_time} seconds ({attempt}x).")
+        rate_limiter.backoff(method, sleep_time)
 
 
 # pagination handling
@@ -106,6 +595,7 @@ def get_at_cursor(url, params, cursor=None, response_url=None):
         if d["ok"] is False:
             handle_print("I encountered an error: %s" % d, response_url)
             sys.exit(1)
+        API_PAGES.inc(method=api_method(url))
 
         next_cursor = None
         if "response_metadata" in d and "next_cursor" in d["response_metadata"]:
@@ -120,24 +610,133 @@ def get_at_cursor(url, params, cursor=None, response_url=None):
         return None, []
 
 
-def paginated_get(url, params, combine_key=None, response_url=None):
-    next_cursor = None
-    result = []
-    while True:
-        next_cursor, data = get_at_cursor(
-            url, params, cursor=next_cursor, response_url=response_url
-        )
+class PageJournal:
+    """Append-only file of fetched pages and the cursor following each one
+
+    Lets a paginated fetch that died part-way continue after its last
+    completed page. The first line records the request, so a journal written
+    for different parameters is not replayed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pages = 0
+        self.next_cursor = None
+        self._request = None
+        self._valid_size = None  # bytes of the journal that can be kept
+        self._fh = None
 
+    def replay(self, url, params):
+        """Yield the items of every journaled page of this request"""
+        self._request = {
+            "url": url,
+            "params": {k: v for k, v in params.items() if k != "cursor"},
+        }
         try:
-            result.extend(data) if combine_key is None else result.extend(
-                data[combine_key]
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            header = f.readline()
+            try:
+                if json.loads(header) != self._request:
+                    return
+            except ValueError:
+                return
+            size = len(header)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn write from a crash
+                record = json.loads(line)
+                size += len(line)
+                self._valid_size = size
+                self.pages += 1
+                self.next_cursor = record["next_cursor"]
+                yield record["items"]
+            if self._valid_size is None:
+                self._valid_size = size
+
+    @property
+    def complete(self):
+        return self.pages > 0 and self.next_cursor is None
+
+    def append(self, items, next_cursor):
+        if self._fh is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if self._valid_size is None:
+                self._fh = open(self.path, "wb")
+                self._fh.write(json.dumps(self._request).encode("utf-8") + b"\n")
+            else:
+                self._fh = open(self.path, "r+b")
+                self._fh.truncate(self._valid_size)
+                self._fh.seek(self._valid_size)
+        record = {"next_cursor": next_cursor, "items": items}
+        self._fh.write(json.dumps(record).encode("utf-8") + b"\n")
+        self._fh.flush()
+        self.pages += 1
+        self.next_cursor = next_cursor
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+class JournalStore:
+    """Page journals of one conversation, kept together in a directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def journal(self, name):
+        return PageJournal(os.path.join(self.directory, "%s.jsonl" % name))
+
+    def discard(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def iter_pages(url, params, combine_key=None, response_url=None, journal=None):
+    """Yield the items of each page as soon as it is fetched
+
+    With a journal, pages fetched by an earlier attempt are replayed first and
+    fetching continues from the cursor after the last of them.
+    """
+    next_cursor = None
+    if journal is not None:
+        for items in journal.replay(url, params):
+            yield items
+        if journal.complete:
+            return
+        next_cursor = journal.next_cursor
+
+    try:
+        while True:
+            next_cursor, data = get_at_cursor(
+                url, params, cursor=next_cursor, response_url=response_url
             )
-        except KeyError as e:
-            handle_print("Something went wrong: %s." % e, response_url)
-            sys.exit(1)
 
-        if next_cursor is None:
-            break
+            try:
+                items = data if combine_key is None else data[combine_key]
+            except KeyError as e:
+                handle_print("Something went wrong: %s." % e, response_url)
+                sys.exit(1)
+
+            if journal is not None:
+                journal.append(items, next_cursor)
+
+            yield items
+
+            if next_cursor is None:
+                break
+    finally:
+        if journal is not None:
+            journal.close()
+
+
+def paginated_get(url, params, combine_key=None, response_url=None, journal=None):
+    result = []
+    for page in iter_pages(url, params, combine_key, response_url, journal):
+        result.extend(page)
 
     return result
 
@@ -161,19 +760,56 @@ def channel_list(team_id=None, response_url=None):
     )
 
 
-def get_file_list():
-    current_page = 1
-    total_pages = 1
-    while current_page <= total_pages:
-        response = get_data("https://slack.com/api/files.list", params={"page": current_page})
-        json_data = response.json()
-        total_pages = json_data["paging"]["pages"]
-        for file in json_data["files"]:
-            yield file
-        current_page += 1
-
-
-def channel_history(channel_id, response_url=None, oldest=None, latest=None):
+# files per files.list page; Slack's default is 100
+FILES_PAGE_SIZE = 1000
+
+
+def get_file_list(
+    channel=None, user=None, types=None, ts_from=None, ts_to=None, max_size=None
+):
+    """Yield the workspace's files, optionally only those matching the filters
+
+    channel, user, types (comma-separated, e.g. "images,pdfs") and the
+    ts_from/ts_to Unix timestamps are passed on to files.list; max_size (in
+    bytes) is applied here. The next page is fetched in the background while
+    the current one is consumed.
+    """
+    params = {"count": FILES_PAGE_SIZE}
+    for key, value in (
+        ("channel", channel),
+        ("user", user),
+        ("types", types),
+        ("ts_from", ts_from),
+        ("ts_to", ts_to),
+    ):
+        if value is not None:
+            params[key] = value
+
+    def fetch(page):
+        response = get_data(
+            "https://slack.com/api/files.list", params=dict(params, page=page)
+        )
+        return response.json()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        current_page = 1
+        next_page = executor.submit(fetch, current_page)
+        while next_page is not None:
+            json_data = next_page.result()
+            total_pages = json_data["paging"]["pages"]
+            next_page = None
+            if current_page < total_pages:
+                current_page += 1
+                next_page = executor.submit(fetch, current_page)
+            for file in json_data["files"]:
+                if max_size is None or file.get("size", 0) <= max_size:
+                    yield file
+
+
+def iter_channel_history(
+    channel_id, response_url=None, oldest=None, latest=None, journal=None
+):
+    """Yield the channel's messages one page (up to 200 messages) at a time"""
     params = {
         # "token": os.environ["SLACK_USER_TOKEN"],
         "channel": channel_id,
@@ -185,14 +821,23 @@ def channel_history(channel_id, response_url=None, oldest=None, latest=None):
     if latest is not None:
         params["latest"] = latest
 
-    return paginated_get(
+    return iter_pages(
         "https://slack.com/api/conversations.history",
         params,
         combine_key="messages",
         response_url=response_url,
+        journal=journal,
     )
 
 
+def channel_history(channel_id, response_url=None, oldest=None, latest=None, journal=None):
+    result = []
+    for page in iter_channel_history(channel_id, response_url, oldest, latest, journal):
+        result.extend(page)
+
+    return result
+
+
 def user_list(team_id=None, response_url=None):
     params = {
         # "token": os.environ["SLACK_USER_TOKEN"],
@@ -208,32 +853,343 @@ def user_list(team_id=None, response_url=None):
     )
 
 
-def channel_replies(timestamps, channel_id, response_url=None):
-    replies = []
-    for timestamp in timestamps:
-        params = {
-            # "token": os.environ["SLACK_USER_TOKEN"],
-            "channel": channel_id,
-            "ts": timestamp,
-            "limit": 200,
-        }
-        replies.append(
-            paginated_get(
-                "https://slack.com/api/conversations.replies",
-                params,
-                combine_key="messages",
-                response_url=response_url,
-            )
+def thread_replies(timestamp, channel_id, response_url=None, journal=None):
+    params = {
+        # "token": os.environ["SLACK_USER_TOKEN"],
+        "channel": channel_id,
+        "ts": timestamp,
+        "limit": 200,
+    }
+
+    return paginated_get(
+        "https://slack.com/api/conversations.replies",
+        params,
+        combine_key="messages",
+        response_url=response_url,
+        journal=journal,
+    )
+
+
+def iter_channel_replies(
+    timestamps, channel_id, response_url=None, workers=None, journals=None
+):
+    """Yield the replies of each thread, in the same order as timestamps
+
+    Up to `workers` threads are fetched at once; all of them draw on the shared
+    conversations.replies rate budget. At most 2 * workers fetched threads are
+    held in memory while waiting for earlier ones to be consumed. With a
+    JournalStore, every thread is journaled under "replies-<ts>".
+    """
+    if workers is None:
+        workers = REPLY_WORKERS
+
+    def fetch(timestamp):
+        journal = journals.journal("replies-%s" % timestamp) if journals else None
+        return thread_replies(timestamp, channel_id, response_url, journal)
+
+    if workers <= 1:
+        for timestamp in timestamps:
+            yield fetch(timestamp)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        try:
+            for timestamp in timestamps:
+                pending.append(executor.submit(fetch, timestamp))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def channel_replies(
+    timestamps, channel_id, response_url=None, workers=None, journals=None
+):
+    return list(
+        iter_channel_replies(timestamps, channel_id, response_url, workers, journals)
+    )
+
+
+# SQLite archive (see archive.py)
+
+# results printed by --search unless --search-limit says otherwise
+SEARCH_LIMIT = 20
+
+
+def sync_history(
+    archive, channel_id, response_url=None, oldest=None, latest=None, journal=None
+):
+    """Fetch the channel's messages that are not archived yet into archive
+
+    Without bounds, everything newer than the archive's mark is fetched and
+    the mark moves up to the newest message. With oldest/latest only that
+    window is fetched, and the mark stays where it is unless the window
+    started at it.
+    """
+    mark = archive.latest_ts(channel_id)
+    if mark is not None and latest is not None and float(latest) <= float(mark):
+        return  # already archived
+    start, advance = mark, latest is None
+    if oldest is not None and (mark is None or float(oldest) > float(mark)):
+        start, advance = oldest, False
+
+    newest = None
+    for page in iter_channel_history(
+        channel_id, response_url, oldest=start, latest=latest, journal=journal
+    ):
+        archive.store_messages(channel_id, page)
+        newest = newest_ts(page + ([{"ts": newest}] if newest else []))
+    if advance and newest is not None:
+        archive.set_latest_ts(channel_id, newest)
+
+
+def sync_replies(
+    archive, timestamps, channel_id, response_url=None, workers=None, journals=None
+):
+    """Fetch the threads among timestamps that changed since they were
+    archived, or were never archived, into archive"""
+    stale = archive.stale_threads(channel_id, timestamps)
+    threads = iter_channel_replies(stale, channel_id, response_url, workers, journals)
+    for timestamp, thread in zip(stale, threads):
+        archive.store_thread(channel_id, timestamp, thread)
+
+
+def archived_history(
+    archive, channel_id, response_url=None, oldest=None, latest=None, journal=None
+):
+    """channel_history, served from archive after bringing it up to date"""
+    sync_history(archive, channel_id, response_url, oldest, latest, journal)
+    return archive.history(channel_id, oldest, latest)
+
+
+def archived_replies(
+    archive, timestamps, channel_id, response_url=None, workers=None, journals=None
+):
+    """channel_replies, served from archive after bringing it up to date"""
+    sync_replies(archive, timestamps, channel_id, response_url, workers, journals)
+    return [archive.thread(channel_id, timestamp) for timestamp in timestamps]
+
+
+# workspace metadata cache
+
+METADATA_CACHE_DIR = os.environ.get(
+    "SLACK_METADATA_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"),
+)
+# seconds a cached users.list / conversations.list stays fresh; 0 disables
+METADATA_CACHE_TTL = float(os.environ.get("SLACK_METADATA_CACHE_TTL", 3600))
+
+
+class MetadataCache:
+    """users.list and conversations.list results cached on disk with a TTL
+
+    Entries are JSON files named by kind, team id and a hash of the token, so
+    separate workspaces and tokens never share data. They are replaced
+    atomically, so gunicorn workers and CLI runs can share one directory. A
+    parsed copy is kept in memory for as long as the file is unchanged.
+    """
+
+    def __init__(self, directory=None, ttl=None):
+        self.directory = METADATA_CACHE_DIR if directory is None else directory
+        self.ttl = METADATA_CACHE_TTL if ttl is None else ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._loaded = {}  # path -> (mtime_ns, data)
+
+    def _path(self, kind, team_id):
+        token_hash = hashlib.sha256(SLACK_TOKEN.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(
+            self.directory, "%s-%s-%s.json" % (kind, team_id or "default", token_hash)
         )
 
-    return replies
+    def _load(self, path):
+        """Cached data at path if it is fresh, else None"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if time() - st.st_mtime >= self.ttl:
+            return None
+        with self._lock:
+            loaded = self._loaded.get(path)
+        if loaded is not None and loaded[0] == st.st_mtime_ns:
+            return loaded[1]
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self._loaded[path] = (st.st_mtime_ns, data)
+        return data
+
+    def _store(self, path, data):
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        tmp_path = "%s.%i.%i.tmp" % (path, os.getpid(), threading.get_ident())
+        with open(tmp_path, mode="w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._loaded[path] = (os.stat(path).st_mtime_ns, data)
+
+    def get(self, kind, team_id, fetch, refresh=False):
+        """Return the cached kind for team_id, or call fetch() and cache it"""
+        path = self._path(kind, team_id)
+        data = None if refresh or self.ttl <= 0 else self._load(path)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if data is None:
+            data = fetch()
+            if self.ttl > 0:
+                self._store(path, data)
+        return data
+
+    def invalidate(self):
+        """Drop every cached entry"""
+        with self._lock:
+            self._loaded.clear()
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def report(self):
+        stats = self.stats()
+        return "Metadata cache: %i hits, %i misses" % (stats["hits"], stats["misses"])
+
+
+metadata_cache = MetadataCache()
+
+
+def cached_user_list(team_id=None, response_url=None, refresh=False):
+    """user_list through metadata_cache"""
+    return metadata_cache.get(
+        "users", team_id, lambda: user_list(team_id, response_url), refresh
+    )
+
+
+def cached_channel_list(team_id=None, response_url=None, refresh=False):
+    """channel_list through metadata_cache"""
+    return metadata_cache.get(
+        "channels", team_id, lambda: channel_list(team_id, response_url), refresh
+    )
 
 
 # parsing
 
 
-def parse_channel_list(channels, users):
-    result = ""
+class Directory:
+    """Users and channels of a workspace indexed by id
+
+    Build it once per run from user_list() and channel_list() and pass it
+    wherever a list of users or channels is expected; lookups are O(1)
+    instead of a scan of the whole list. Iterating it yields the users.
+    """
+
+    def __init__(self, users=(), channels=()):
+        self.users = list(users)
+        self.channels = list(channels)
+        self._users = {u["id"]: u for u in self.users}
+        self._channels = {c["id"]: c for c in self.channels}
+
+    @classmethod
+    def of(cls, users):
+        """Return users as a Directory, indexing a plain list if needed"""
+        return users if isinstance(users, Directory) else cls(users)
+
+    def __iter__(self):
+        return iter(self.users)
+
+    def __len__(self):
+        return len(self.users)
+
+    def user(self, user_id):
+        return self._users.get(user_id)
+
+    def channel(self, channel_id):
+        return self._channels.get(channel_id)
+
+    def name(self, user_id):
+        user = self._users.get(user_id)
+        return "[null user]" if user is None else user["name"]
+
+    def real_name(self, user_id):
+        user = self._users.get(user_id)
+        if user is None:
+            return "[null user]"
+        try:
+            return user["profile"]["real_name"]
+        except KeyError:
+            try:
+                return user["profile"]["display_name"]
+            except KeyError:
+                return "[no full name]"
+
+    def display_name(self, user_id):
+        user = self._users.get(user_id)
+        if user is None:
+            return "[null user]"
+        return user.get("profile", {}).get("display_name", "")
+
+    def channel_name(self, channel_id):
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            return "[null channel]"
+        return (
+            (channel["user"], "Direct Message")
+            if "user" in channel
+            else (channel["name"], "Channel")
+        )
+
+
+MRKDWN_ENTITY_RE = re.compile(r"<([^<>\n]+)>")
+
+
+def render_mrkdwn(text, directory):
+    """Rewrite Slack's <...> entities in a single pass over the text
+
+    <@U123> becomes "<@U123> (name)" for known users, <#C123|general> becomes
+    "#general", <!here> becomes "@here" and <https://x|label> becomes
+    "label (https://x)". Unknown entities are left alone.
+    """
+
+    def rewrite(m):
+        body = m.group(1)
+        target, _, label = body.partition("|")
+        if target.startswith("@"):
+            user = None if label else directory.user(target[1:])
+            return m.group(0) if user is None else "%s (%s)" % (m.group(0), user["name"])
+        if target.startswith("#"):
+            if not label:
+                channel = directory.channel(target[1:])
+                label = channel.get("name") if channel is not None else None
+            return "#%s" % label if label else m.group(0)
+        if target.startswith("!"):
+            if label:
+                return label
+            return "@%s" % target[1:] if target[1:].isalpha() else m.group(0)
+        if ":" in target:  # http(s), mailto, ...
+            return "%s (%s)" % (label, target) if label else target
+        return m.group(0)
+
+    return MRKDWN_ENTITY_RE.sub(rewrite, text)
+
+
+def write_channel_list(fh, channels, users):
+    users = Directory.of(users)
     for channel in channels:
         ch_id = channel["id"]
         ch_name = channel["name"] if "name" in channel else ""
@@ -255,18 +1211,21 @@ def parse_channel_list(channels, users):
         else:
             ch_ownership = ""
         ch_name = " %s:" % ch_name if ch_name.strip() != "" else ch_name
-        result += "[%s]%s %s%s %s\n" % (
-            ch_id,
-            ch_name,
-            ch_private,
-            ch_type,
-            ch_ownership,
+        fh.write(
+            "[%s]%s %s%s %s\n" % (ch_id, ch_name, ch_private, ch_type, ch_ownership)
         )
 
-    return result
+
+def parse_channel_list(channels, users):
+    result = io.StringIO()
+    write_channel_list(result, channels, users)
+    return result.getvalue()
 
 
 def name_from_uid(user_id, users, real=False):
+    if isinstance(users, Directory):
+        return users.real_name(user_id) if real else users.name(user_id)
+
     for user in users:
         if user["id"] != user_id:
             continue
@@ -286,6 +1245,9 @@ def name_from_uid(user_id, users, real=False):
 
 
 def name_from_ch_id(channel_id, channels):
+    if isinstance(channels, Directory):
+        return channels.channel_name(channel_id)
+
     for channel in channels:
         if channel["id"] == channel_id:
             return (
@@ -296,8 +1258,7 @@ def name_from_ch_id(channel_id, channels):
     return "[null channel]"
 
 
-def parse_user_list(users):
-    result = ""
+def write_user_list(fh, users):
     for u in users:
         entry = "[%s]" % u["id"]
 
@@ -337,126 +1298,775 @@ def parse_user_list(users):
 
         entry += ", " if u_type.strip() != "" else ""
         entry += "%s\n" % u_type
-        result += entry
+        fh.write(entry)
 
-    return result
 
+def parse_user_list(users):
+    result = io.StringIO()
+    write_user_list(result, users)
+    return result.getvalue()
 
-def parse_channel_history(msgs, users, check_thread=False):
+
+def render_message(msg, users, check_thread=False):
+    """Render one message as a text entry; users must be a Directory"""
+    if "user" in msg:
+        usr = {
+            "name": name_from_uid(msg["user"], users),
+            "real_name": name_from_uid(msg["user"], users, real=True),
+        }
+    else:
+        usr = {"name": "", "real_name": "none"}
+
+    timestamp = datetime.fromtimestamp(round(float(msg["ts"]))).strftime(
+        "%Y-%m-%d %H:%M:%S"
+    )
+    text = msg["text"] if msg["text"].strip() != "" else "[no message content]"
+    text = render_mrkdwn(str(text), users)
+
+    entry = "Message at %s\nUser: %s (%s)\n%s" % (
+        timestamp,
+        usr["name"],
+        usr["real_name"],
+        text,
+    )
+    if "reactions" in msg:
+        rxns = msg["reactions"]
+        entry += "\nReactions: " + ", ".join(
+            "%s (%s)"
+            % (x["name"], ", ".join(name_from_uid(u, users) for u in x["users"]))
+            for x in rxns
+        )
+    if "files" in msg:
+        files = msg["files"]
+        deleted = [
+            f for f in files if "name" not in f or "url_private_download" not in f
+        ]
+        ok_files = [f for f in files if f not in deleted]
+        entry += "\nFiles:\n"
+        entry += "\n".join(
+            " - [%s] %s, %s" % (f["id"], f["name"], f["url_private_download"])
+            for f in ok_files
+        )
+        entry += "\n".join(
+            " - [%s] [deleted, oversize, or unavailable file]" % f["id"]
+            for f in deleted
+        )
+
+    entry += "\n\n%s\n\n" % ("*" * 24)
+
+    if check_thread and "parent_user_id" in msg:
+        entry = "\t" + entry.replace("\n", "\n\t")
+
+    return entry.rstrip("\t")  # get rid of any extra tabs between trailing newlines
+
+
+def write_channel_history(fh, msgs, users, check_thread=False):
+    """Write messages as text to any writable, one entry at a time
+
+    Returns the number of messages written.
+    """
     if "messages" in msgs:
         msgs = msgs["messages"]
 
-    messages = [x for x in msgs if x["type"] == "message"]  # files are also messages
-    body = ""
-    for msg in messages:
-        if "user" in msg:
-            usr = {
-                "name": name_from_uid(msg["user"], users),
-                "real_name": name_from_uid(msg["user"], users, real=True),
-            }
-        else:
-            usr = {"name": "", "real_name": "none"}
+    users = Directory.of(users)
+    count = 0
+    for msg in msgs:
+        if msg["type"] != "message":  # files are also messages
+            continue
+        fh.write(render_message(msg, users, check_thread))
+        count += 1
 
+    return count
+
+
+def parse_channel_history(msgs, users, check_thread=False):
+    body = io.StringIO()
+    write_channel_history(body, msgs, users, check_thread)
+    return body.getvalue()
+
+
+def write_replies(fh, threads, users):
+    users = Directory.of(users)
+    for thread in threads:
+        write_channel_history(fh, thread, users, check_thread=True)
+        fh.write("\n")
+
+
+def parse_replies(threads, users):
+    body = io.StringIO()
+    write_replies(body, threads, users)
+    return body.getvalue()
+
+
+def write_search_results(fh, results, directory):
+    """Write Archive.search results as text, best match first; directory must
+    be a Directory of users and channels"""
+    for msg in results:
+        channel = directory.channel(msg["channel"])
+        if channel is None:
+            where = msg["channel"]
+        elif "user" in channel:
+            where = "DM with %s" % directory.name(channel["user"])
+        else:
+            where = "#%s" % channel["name"]
         timestamp = datetime.fromtimestamp(round(float(msg["ts"]))).strftime(
             "%Y-%m-%d %H:%M:%S"
         )
-        text = msg["text"] if msg["text"].strip() != "" else "[no message content]"
-        for u in [x["id"] for x in users]:
-            text = str(text).replace(
-                "<@%s>" % u, "<@%s> (%s)" % (u, name_from_uid(u, users))
+        fh.write(
+            "Message at %s in %s [%s]\nUser: %s (%s)\n%s\n\n%s\n\n"
+            % (
+                timestamp,
+                where,
+                msg["ts"],
+                directory.name(msg.get("user")),
+                directory.real_name(msg.get("user")),
+                render_mrkdwn(msg["snippet"] or "", directory),
+                "*" * 24,
             )
+        )
 
-        entry = "Message at %s\nUser: %s (%s)\n%s" % (
-            timestamp,
-            usr["name"],
-            usr["real_name"],
-            text,
+
+class JsonArrayWriter:
+    """Writes a JSON array to a file handle one element at a time
+
+    With indent=4 the output is identical to json.dump(items, fh, indent=4).
+    """
+
+    def __init__(self, fh, indent=None, ensure_ascii=True, separators=None):
+        self.fh = fh
+        self.indent = indent
+        self.ensure_ascii = ensure_ascii
+        self.separators = separators
+        self.count = 0
+
+    def write(self, item):
+        data = json.dumps(
+            item,
+            indent=self.indent,
+            ensure_ascii=self.ensure_ascii,
+            separators=self.separators,
         )
-        if "reactions" in msg:
-            rxns = msg["reactions"]
-            entry += "\nReactions: " + ", ".join(
-                "%s (%s)"
-                % (x["name"], ", ".join(name_from_uid(u, users) for u in x["users"]))
-                for x in rxns
-            )
-        if "files" in msg:
-            files = msg["files"]
-            deleted = [
-                f for f in files if "name" not in f or "url_private_download" not in f
-            ]
-            ok_files = [f for f in files if f not in deleted]
-            entry += "\nFiles:\n"
-            entry += "\n".join(
-                " - [%s] %s, %s" % (f["id"], f["name"], f["url_private_download"])
-                for f in ok_files
-            )
-            entry += "\n".join(
-                " - [%s] [deleted, oversize, or unavailable file]" % f["id"]
-                for f in deleted
-            )
+        if self.indent is None:
+            item_sep = ", " if self.separators is None else self.separators[0]
+            self.fh.write("[" if self.count == 0 else item_sep)
+        else:
+            pad = " " * self.indent
+            self.fh.write("[\n" if self.count == 0 else ",\n")
+            data = pad + data.replace("\n", "\n" + pad)
+        self.fh.write(data)
+        self.count += 1
+
+    def write_all(self, items):
+        for item in items:
+            self.write(item)
+
+    def write_thread(self, thread):
+        """Write a reply thread as one element, the list of its messages"""
+        self.write(thread)
+
+    def close(self):
+        if self.count == 0:
+            self.fh.write("[]")
+        else:
+            self.fh.write("]" if self.indent is None else "\n]")
 
-        entry += "\n\n%s\n\n" % ("*" * 24)
 
-        if check_thread and "parent_user_id" in msg:
-            entry = "\n".join("\t%s" % x for x in entry.split("\n"))
+class JsonLinesWriter:
+    """Writes one JSON document per line (JSON Lines), same interface as
+    JsonArrayWriter"""
 
-        body += entry.rstrip(
-            "\t"
-        )  # get rid of any extra tabs between trailing newlines
+    def __init__(self, fh, ensure_ascii=True):
+        self.fh = fh
+        self.ensure_ascii = ensure_ascii
+        self.count = 0
 
-    return body
+    def write(self, item):
+        self.fh.write(json.dumps(item, ensure_ascii=self.ensure_ascii) + "\n")
+        self.count += 1
 
+    def write_all(self, items):
+        for item in items:
+            self.write(item)
 
-def parse_replies(threads, users):
-    body = ""
-    for thread in threads:
-        body += parse_channel_history(thread, users, check_thread=True)
-        body += "\n"
+    def write_thread(self, thread):
+        """Write a reply thread one message per line, each with its thread_ts,
+        so reply files can be split anywhere like history files"""
+        for msg in thread:
+            if "thread_ts" not in msg:
+                msg = dict(msg, thread_ts=thread[0]["ts"])
+            self.write(msg)
 
-    return body
+    def close(self):
+        pass
 
 
-def download_file(destination_path, url, attempt = 0):
-    if os.path.exists(destination_path):
-        print("Skipping existing %s" % destination_path)
+OUTPUT_FORMATS = ("text", "json", "json-compact", "jsonl")
+
+
+def output_extension(fmt):
+    """File extension for one of OUTPUT_FORMATS"""
+    return {"text": ".txt", "jsonl": ".jsonl"}.get(fmt, ".json")
+
+
+def json_writer(fh, fmt="json", ensure_ascii=True):
+    """Streaming writer for a JSON output format
+
+    "json" is an indented array, "json-compact" an array without whitespace
+    and "jsonl" one element per line; reply threads (write_thread) are one
+    element of an array, but one message per line of JSON Lines.
+    """
+    if fmt == "jsonl":
+        return JsonLinesWriter(fh, ensure_ascii=ensure_ascii)
+    if fmt == "json-compact":
+        return JsonArrayWriter(fh, ensure_ascii=ensure_ascii, separators=(",", ":"))
+    return JsonArrayWriter(fh, indent=4, ensure_ascii=ensure_ascii)
+
+
+# compressed output
+
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "xz": ".xz", "bz2": ".bz2"}
+_COMPRESSED_OPENERS = {
+    # level 6 like the gzip command; 9 is much slower for little gain on text
+    ".gz": lambda path, mode, **kw: gzip.open(path, mode, compresslevel=6, **kw),
+    ".xz": lzma.open,
+    ".bz2": bz2.open,
+}
+
+
+def compression_extension(path):
+    """".gz", ".xz" or ".bz2" for a compressed file name, otherwise "" """
+    ext = os.path.splitext(path)[1]
+    return ext if ext in _COMPRESSED_OPENERS else ""
+
+
+def with_suffix(path, suffix):
+    """Add suffix to a file name, in front of any compression extension"""
+    ext = compression_extension(path)
+    return path[: len(path) - len(ext)] + suffix + ext
+
+
+def open_file(path, mode="r", encoding="utf-8"):
+    """Like open(), but streams through gzip, xz or bz2 by file extension"""
+    opener = _COMPRESSED_OPENERS.get(compression_extension(path))
+    if opener is None:
+        if "b" in mode:
+            return open(path, mode)
+        return open(path, mode, encoding=encoding)
+    if "b" in mode:
+        return opener(path, mode)
+    return opener(path, mode + "t", encoding=encoding)
+
+
+# incremental exports
+
+EXPORT_STATE_FILE = "export_state.json"
+MESSAGE_COUNT_RE = re.compile(r"^(\d+) Messages$")
+
+
+def newest_ts(msgs):
+    """Return the newest message timestamp, or None for no messages"""
+    return max((x["ts"] for x in msgs), key=float, default=None)
+
+
+class ExportState:
+    """Newest exported message ts per output file name, persisted as JSON
+
+    The format each output was written in is kept too, since "json" and
+    "json-compact" files share a name: a mark only applies to its format. So
+    is the output's size after the mark was saved; a file of another size was
+    changed afterwards (e.g. merged by a run that died before saving its
+    mark), and its mark cannot be trusted.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {}
+        self._marks = state.get("outputs", {})
+        self._formats = state.get("formats", {})
+        self._sizes = state.get("sizes", {})
+
+    def latest_ts(self, name, fmt=None, size=None):
+        """The output's mark, or None if it was written in another format or
+        had another size"""
+        with self._lock:
+            if fmt is not None and self._formats.get(name) != fmt:
+                return None
+            if size is not None and self._sizes.get(name) != size:
+                return None
+            return self._marks.get(name)
+
+    def update(self, name, ts, fmt=None, size=None):
+        """Record ts as the output's high-water mark if it is newer, and the
+        format and size the output was written with
+
+        If the output was rewritten in another format, its old mark is
+        replaced (or dropped, if ts is None).
+        """
+        with self._lock:
+            if fmt is not None and self._formats.get(name) != fmt:
+                for values in (self._marks, self._formats, self._sizes):
+                    values.pop(name, None)
+            current = self._marks.get(name)
+            if ts is not None and (current is None or float(ts) > float(current)):
+                self._marks[name] = ts
+            if name in self._marks:
+                if fmt is not None:
+                    self._formats[name] = fmt
+                if size is not None:
+                    self._sizes[name] = size
+            state = {
+                "outputs": self._marks,
+                "formats": self._formats,
+                "sizes": self._sizes,
+            }
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, mode="w", encoding="utf-8") as f:
+                json.dump(state, f, indent=4, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+def _read_text_header(fh, sep):
+    """Consume a text export's header; return its lines and message count"""
+    lines, count = [], None
+    while True:
+        line = fh.readline()
+        if not line or line.rstrip("\n") == sep:
+            fh.readline()  # blank line after the separator
+            return lines, count
+        m = MESSAGE_COUNT_RE.match(line.rstrip("\n"))
+        if m:
+            count = int(m.group(1))
+        else:
+            lines.append(line)
+
+
+def _read_tail(path, size=64):
+    """Last size bytes of a file, decompressed"""
+    with open_file(path, "rb") as f:
+        if not compression_extension(path):
+            f.seek(max(0, os.path.getsize(path) - size))
+        tail = b""
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            tail = (tail + chunk)[-size:]
+    return tail
+
+
+def _text_export_count(path, sep):
+    """Message count from a text export's header, or from its trailer (--stream)"""
+    with open_file(path) as f:
+        _, count = _read_text_header(f, sep)
+    if count is not None:
+        return count
+    last_line = _read_tail(path).decode("utf-8", "ignore").rstrip("\n").rsplit("\n", 1)[-1]
+    m = MESSAGE_COUNT_RE.match(last_line)
+    return int(m.group(1)) if m else 0
+
+
+def _copy_text_body(src, dst):
+    """Copy the rest of a text export, leaving out a message count trailer"""
+    prev = None
+    for line in src:
+        if prev is not None:
+            dst.write(prev)
+        prev = line
+    if prev is not None and not MESSAGE_COUNT_RE.match(prev.rstrip("\n")):
+        dst.write(prev)
+
+
+def _merge_text_export(new_path, path, out_path, sep):
+    new_count = _text_export_count(new_path, sep)
+    if new_count == 0:
+        return False
+    old_count = _text_export_count(path, sep)
+
+    with open_file(new_path) as new, open_file(path) as old, open_file(
+        out_path, mode="w"
+    ) as out:
+        header, _ = _read_text_header(new, sep)
+        _read_text_header(old, sep)
+        out.writelines(header)
+        out.write("%s Messages\n%s\n\n" % (new_count + old_count, sep))
+        _copy_text_body(new, out)
+        _copy_text_body(old, out)
+    return True
+
+
+def _json_array_framing(fh):
+    """Read the opening of a JSON array export
+
+    Returns (closing, separator, rest) as bytes, where rest is what was read
+    past the opening bracket, or None for an empty array.
+    """
+    head = fh.read(2)
+    if head == b"[]":
+        return None
+    if head == b"[\n":  # indented
+        return b"\n]", b",\n", b""
+    return b"]", b",", head[1:]
+
+
+def _merge_json_export(new_path, path, out_path):
+    with open_file(new_path, "rb") as new, open_file(path, "rb") as old:
+        framing = _json_array_framing(new)
+        if framing is None:
+            return False  # nothing new
+        closing, separator, pending = framing
+        with open_file(out_path, "wb") as out:
+            out.write(b"[\n" if closing == b"\n]" else b"[")
+            # copy the new elements, holding back the closing bracket
+            for chunk in iter(lambda: new.read(1 << 20), b""):
+                pending += chunk
+                out.write(pending[: -len(closing)])
+                pending = pending[-len(closing) :]
+            old_framing = _json_array_framing(old)
+            if old_framing is not None:
+                out.write(separator + old_framing[2])
+                shutil.copyfileobj(old, out)
+            else:
+                out.write(closing)
+    return True
+
+
+def _merge_jsonl_export(new_path, path, out_path):
+    with open_file(new_path, "rb") as new:
+        if not new.read(1):
+            return False
+    # gzip, xz and bz2 streams may be concatenated, so compressed files are
+    # joined as they are without recompressing
+    with open(out_path, "wb") as out:
+        for src in (new_path, path):
+            with open(src, "rb") as f:
+                shutil.copyfileobj(f, out)
+    return True
+
+
+def merge_export(new_path, path, sep="*" * 24):
+    """Put the export at new_path in front of the older export at path
+
+    Both must be exports of the same conversation in the same format, text,
+    a JSON array or JSON Lines, and compression. The old file is copied rather
+    than loaded, and new_path is removed afterwards.
+    """
+    tmp_path = with_suffix(path, ".tmp")
+    fmt_path = path[: len(path) - len(compression_extension(path))]
+    if fmt_path.endswith(".jsonl"):
+        merged = _merge_jsonl_export(new_path, path, tmp_path)
+    elif fmt_path.endswith(".json"):
+        merged = _merge_json_export(new_path, path, tmp_path)
+    else:
+        merged = _merge_text_export(new_path, path, tmp_path, sep)
+    if merged:
+        os.replace(tmp_path, path)
+    os.remove(new_path)
+
+
+# file downloads
+
+# files downloaded concurrently by save_files
+FILE_WORKERS = int(os.environ.get("SLACK_FILE_WORKERS", 4))
+FILE_DOWNLOAD_ATTEMPTS = 10
+FILE_CHUNK_SIZE = 1 << 20
+# seconds before the first retry of a failed download, doubled every attempt
+FILE_RETRY_BACKOFF = 1
+FILE_RETRY_BACKOFF_MAX = 60
+
+
+class DownloadStats:
+    """Thread-safe counters for save_files"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = default_timer()
+        self.files = 0
+        self.skipped = 0
+        self.resumed = 0
+        self.failed = 0
+        self.bytes = 0
+
+    def add_bytes(self, n):
+        with self._lock:
+            self.bytes += n
+
+    def count(self, outcome):
+        """outcome is "files", "skipped", "resumed" or "failed" """
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def report(self):
+        with self._lock:
+            seconds = default_timer() - self.started
+            mb = self.bytes / 1e6
+            return (
+                "Downloaded %i files (%.1f MB) in %i seconds, %.2f MB/s; "
+                "%i already present, %i resumed, %i failed"
+                % (
+                    self.files,
+                    mb,
+                    seconds,
+                    mb / seconds if seconds > 0 else 0,
+                    self.skipped,
+                    self.resumed,
+                    self.failed,
+                )
+            )
+
+
+FILE_MANIFEST = ".manifest.jsonl"
+# --files downloads go to this directory in -o, shared by every run so that
+# its manifest lets later runs skip the files already there
+FILES_DIR = "files"
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(FILE_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileManifest:
+    """Append-only JSON Lines record of completed downloads, keyed by file id
+
+    Each record holds the file name, the size Slack reported, the bytes
+    written and their sha256; the last record of an id wins. A file counts as
+    complete only if it still has the recorded size (and, with verify, hash).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._fh = None
+        self._valid_size = 0  # a torn last line from a crash is cut off
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line) if line.endswith(b"\n") else None
+                except ValueError:
+                    record = None
+                if record is None:
+                    break
+                self.entries[record["id"]] = record
+                self._valid_size += len(line)
+
+    def is_complete(self, file_id, path, size=None, verify=False):
+        entry = self.entries.get(file_id)
+        if entry is None or entry["name"] != os.path.basename(path):
+            return False
+        if size is not None and entry["size"] != size:
+            return False
+        try:
+            if os.path.getsize(path) != entry["bytes"]:
+                return False
+        except OSError:
+            return False
+        return not verify or file_sha256(path) == entry["sha256"]
+
+    def adopt(self, file_id, path, size):
+        """Record a file downloaded before there was a manifest, if its size
+        matches what Slack reports"""
+        if file_id in self.entries or not size:
+            return False
+        try:
+            if os.path.getsize(path) != size:
+                return False
+        except OSError:
+            return False
+        self.record(file_id, path, size, size, file_sha256(path))
         return True
 
+    def record(self, file_id, path, size, nbytes, sha256):
+        entry = {
+            "id": file_id,
+            "name": os.path.basename(path),
+            "size": size,
+            "bytes": nbytes,
+            "sha256": sha256,
+        }
+        with self._lock:
+            if self._fh is None:
+                self._fh = open(self.path, "ab")
+                self._fh.truncate(self._valid_size)
+            self._fh.write(json.dumps(entry).encode("utf-8") + b"\n")
+            self._fh.flush()
+            self.entries[file_id] = entry
+
+    def close(self):
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-\d+/(?:\d+|\*)$")
+
+
+def download_file(destination_path, url, attempt=0, stats=None, expected_size=None):
+    """Stream url to destination_path
+
+    The body is written in FILE_CHUNK_SIZE pieces to "<path>.part" and renamed
+    once complete, so destination_path only ever holds a whole file. A .part
+    left by an earlier attempt is continued with a Range request; if the
+    server ignores the range, the file is downloaded from the start. Returns
+    (bytes written, sha256 hex digest), or None if the download failed or
+    did not have expected_size bytes.
+    """
     print(f"Downloading file on attempt {attempt} to {destination_path}")
-        
+
+    part_path = destination_path + ".part"
+    digest = hashlib.sha256()
+    nbytes = 0
     try:
-        response = requests.get(url, headers=HEADERS)
-        with open(destination_path, "wb") as fh:
-            fh.write(response.content)
+        if os.path.exists(part_path):
+            nbytes = os.path.getsize(part_path)
+            if expected_size is not None and nbytes > expected_size:
+                nbytes = 0  # not a prefix of this file
+
+        headers = HEADERS
+        if nbytes:
+            headers = dict(HEADERS, Range="bytes=%i-" % nbytes)
+        with get_session().get(
+            url, headers=headers, timeout=http_timeout(), stream=True
+        ) as response:
+            if nbytes and response.status_code == 416:
+                if nbytes != expected_size:
+                    os.remove(part_path)
+                    raise IOError("cannot resume at byte %i, starting over" % nbytes)
+                chunks = iter(())  # the .part was already complete
+            else:
+                response.raise_for_status()
+                chunks = response.iter_content(FILE_CHUNK_SIZE)
+                if response.status_code != 206:
+                    nbytes = 0  # full body, start over
+                else:
+                    m = CONTENT_RANGE_RE.match(response.headers.get("Content-Range", ""))
+                    if m is None or int(m.group(1)) != nbytes:
+                        os.remove(part_path)
+                        raise IOError("unexpected Content-Range, starting over")
+            mode = "r+b" if nbytes else "wb"
+            with open(part_path, mode) as fh:
+                if nbytes:
+                    # the hash covers the whole file, so re-read the kept part
+                    for chunk in iter(lambda: fh.read(FILE_CHUNK_SIZE), b""):
+                        digest.update(chunk)
+                    print(f"Resuming {destination_path} at byte {nbytes}")
+                    if stats is not None:
+                        stats.count("resumed")
+                for chunk in chunks:
+                    fh.write(chunk)
+                    digest.update(chunk)
+                    nbytes += len(chunk)
+                    if stats is not None:
+                        stats.add_bytes(len(chunk))
+        if expected_size is not None and nbytes != expected_size:
+            if nbytes > expected_size:
+                os.remove(part_path)
+            raise IOError("expected %i bytes, got %i" % (expected_size, nbytes))
+        os.replace(part_path, destination_path)
     except Exception as err:
         print(f"Unexpected error on {destination_path} attempt {attempt}; {err=}, {type(err)=}")
-        return False
+        return None
     else:
-        return True
+        if stats is not None:
+            stats.count("files")
+        return nbytes, digest.hexdigest()
+
 
-def save_files(file_dir):
-    total = 0
-    start = default_timer()
-    for file_info in get_file_list():
-        url = file_info["url_private"]
-        file_info["name"] = sanitize_filename(file_info["name"])
-        destination_filename = "{id}-{name}".format(**file_info)
-        os.makedirs(file_dir, exist_ok=True)
-        destination_path = os.path.join(file_dir, destination_filename)
+def fetch_file(file_info, file_dir, stats=None, manifest=None, verify=False):
+    """Download one entry of files.list, retrying with exponential backoff
 
-        download_success = False
-        attempt = 1
-        while not download_success and attempt <= 10:
-           download_success = download_file(destination_path, url, attempt)
-           attempt += 1
+    With a FileManifest, files it lists as complete are skipped and finished
+    downloads are recorded in it. Without one, any existing file is skipped.
+    """
+    url = file_info["url_private"]
+    name = sanitize_filename(file_info["name"])
+    destination_path = os.path.join(file_dir, "%s-%s" % (file_info["id"], name))
+    # Slack's size is not meaningful for externally hosted files
+    size = None if file_info.get("is_external") else file_info.get("size")
 
-        if not download_success:
-            raise Exception("Failed to download from {url} after {attempt} tries")
+    if manifest is None:
+        skip = os.path.exists(destination_path)
+    else:
+        skip = manifest.is_complete(
+            file_info["id"], destination_path, size, verify
+        ) or manifest.adopt(file_info["id"], destination_path, size)
+    if skip:
+        print("Skipping existing %s" % destination_path)
+        if stats is not None:
+            stats.count("skipped")
+        return True
 
-        total += 1
+    for attempt in range(1, FILE_DOWNLOAD_ATTEMPTS + 1):
+        result = download_file(destination_path, url, attempt, stats, size)
+        if result is not None:
+            if manifest is not None:
+                manifest.record(file_info["id"], destination_path, size, *result)
+            return True
+        if attempt < FILE_DOWNLOAD_ATTEMPTS:
+            sleep(min(FILE_RETRY_BACKOFF * 2 ** (attempt - 1), FILE_RETRY_BACKOFF_MAX))
+
+    print(f"Failed to download from {url} after {FILE_DOWNLOAD_ATTEMPTS} tries")
+    if stats is not None:
+        stats.count("failed")
+    return False
+
+
+def save_files(file_dir, workers=None, verify=False, filters=None, archive=None):
+    """Download the workspace's files to file_dir, `workers` at a time
+
+    filters are keyword arguments for get_file_list. With an archive, the
+    metadata of every listed file is stored in it.
+
+    Completed downloads are recorded in FILE_MANIFEST in file_dir, so a rerun
+    only fetches files that are missing, truncated or (with verify) have a
+    different hash. Files that still fail after FILE_DOWNLOAD_ATTEMPTS tries do
+    not stop the others; an exception is raised at the end if there were any.
+    """
+    workers = max(1, FILE_WORKERS if workers is None else workers)
+    os.makedirs(file_dir, exist_ok=True)
+    stats = DownloadStats()
+    manifest = FileManifest(os.path.join(file_dir, FILE_MANIFEST))
 
-    end = default_timer()
-    seconds = int(end - start)
-    print("Downloaded %i files in %i seconds" % (total, seconds))
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # bounded, so listing 300k files does not queue 300k futures
+            pending = deque()
+            listed = []
+            for file_info in get_file_list(**(filters or {})):
+                if archive is not None:
+                    listed.append(file_info)
+                    if len(listed) >= 500:
+                        archive.store_files(listed)
+                        listed = []
+                if "url_private" not in file_info:
+                    continue  # e.g. deleted or hidden by the plan's limit
+                pending.append(
+                    executor.submit(
+                        fetch_file, file_info, file_dir, stats, manifest, verify
+                    )
+                )
+                if len(pending) >= workers * 2:
+                    pending.popleft().result()
+            while pending:
+                pending.popleft().result()
+            if listed:
+                archive.store_files(listed)
+    finally:
+        manifest.close()
+
+    print(stats.report())
+    if stats.failed:
+        raise Exception("Failed to download %i files" % stats.failed)
 
 
 if __name__ == "__main__":
@@ -471,23 +2081,43 @@ if __name__ == "__main__":
     parser.add_argument(
         "--lu", action="store_true", help="List all users in your workspace"
     )
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="text",
+        help="Output format: parsed text (default), an indented JSON array, a "
+        "JSON array without whitespace, or JSON Lines with one message per line "
+        "(replies included, each with its thread_ts)",
+    )
     parser.add_argument(
         "--json",
-        action="store_true",
-        help="Give the requested output in raw JSON format (no parsing)",
+        dest="format",
+        action="store_const",
+        const="json",
+        help="Give the requested output in raw JSON format (no parsing); same "
+        "as --format json",
+    )
+    parser.add_argument(
+        "--compress",
+        choices=sorted(COMPRESSION_EXTENSIONS),
+        help="With -o, compress output files while writing them",
     )
     parser.add_argument(
         "-c", action="store_true", help="Get history for all accessible conversations"
     )
-    parser.add_argument("--ch", help="With -c, restrict export to given channel ID")
+    parser.add_argument(
+        "--ch", help="With -c or --search, restrict export to given channel ID"
+    )
     parser.add_argument(
         "--fr",
-        help="With -c, Unix timestamp (seconds since Jan. 1, 1970) for earliest message",
+        help="With -c or --search, Unix timestamp (seconds since Jan. 1, 1970) "
+        "for earliest message",
         type=str,
     )
     parser.add_argument(
         "--to",
-        help="With -c, Unix timestamp (seconds since Jan. 1, 1970) for latest message",
+        help="With -c or --search, Unix timestamp (seconds since Jan. 1, 1970) "
+        "for latest message",
         type=str,
     )
     parser.add_argument(
@@ -498,10 +2128,165 @@ if __name__ == "__main__":
     parser.add_argument(
         "--files",
         action="store_true",
-        help="Download all files",
+        help="With -o, download all files into %s/ in the output directory; "
+        "every run shares it and its %s manifest, so files already downloaded "
+        "are skipped" % (FILES_DIR, FILE_MANIFEST),
+    )
+    parser.add_argument(
+        "--file-workers",
+        type=int,
+        default=FILE_WORKERS,
+        help="With --files, number of files downloaded concurrently (default: %i)"
+        % FILE_WORKERS,
+    )
+    parser.add_argument(
+        "--verify-files",
+        action="store_true",
+        help="With --files, re-hash already downloaded files and fetch any whose "
+        "sha256 no longer matches the manifest",
+    )
+    parser.add_argument(
+        "--files-channel", help="With --files, only files shared in this channel ID"
+    )
+    parser.add_argument(
+        "--files-user", help="With --files, only files created by this user ID"
+    )
+    parser.add_argument(
+        "--files-types",
+        help="With --files, comma-separated file types, e.g. images,pdfs,zips "
+        "(see Slack's files.list)",
+    )
+    parser.add_argument(
+        "--files-from",
+        help="With --files, Unix timestamp of the earliest file to download",
+    )
+    parser.add_argument(
+        "--files-to",
+        help="With --files, Unix timestamp of the latest file to download",
+    )
+    parser.add_argument(
+        "--files-max-size",
+        type=int,
+        help="With --files, skip files larger than this many bytes",
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        help="Maximum number of pooled HTTP connections (default: %i)" % HTTP_POOL_SIZE,
+    )
+    parser.add_argument(
+        "--connect-timeout",
+        type=float,
+        help="Seconds to wait for a connection to Slack (default: %g)"
+        % HTTP_CONNECT_TIMEOUT,
+    )
+    parser.add_argument(
+        "--read-timeout",
+        type=float,
+        help="Seconds to wait for a response from Slack (default: %g)"
+        % HTTP_READ_TIMEOUT,
+    )
+
+    parser.add_argument(
+        "--rate-headroom",
+        type=float,
+        help="Fraction of each API method's rate limit to use (default: %g)"
+        % RATE_LIMIT_HEADROOM,
+    )
+
+    parser.add_argument(
+        "--reply-workers",
+        type=int,
+        default=REPLY_WORKERS,
+        help="With -r, number of threads to fetch concurrently (default: %i)"
+        % REPLY_WORKERS,
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="With -c or -r, number of conversations to export at once; more "
+        "than 1 needs -o, since stdout cannot be shared (default: 1)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="With -c or -r, write each page to disk as it arrives instead of "
+        "holding whole channels in memory (history is always fetched synchronously; "
+        "with --jobs greater than 1, -o is required)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="With -c or -r, only fetch messages newer than the previous "
+        "--incremental run into the same -o directory, and prepend them to its "
+        "output files (replies added to older threads are not picked up; an "
+        "output that is missing, e.g. after changing --format, is exported in full)",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=METADATA_CACHE_TTL,
+        help="Seconds to reuse the cached user and conversation lists from %s "
+        "(default: %i, 0 disables the cache)" % (METADATA_CACHE_DIR, METADATA_CACHE_TTL),
+    )
+    parser.add_argument(
+        "--refresh-cache",
+        action="store_true",
+        help="Fetch the user and conversation lists again and update the cache",
+    )
+    parser.add_argument(
+        "--archive",
+        metavar="PATH",
+        help="Keep messages, threads, users, conversations and file metadata in "
+        "a SQLite archive at PATH; only messages missing from it are fetched and "
+        "outputs are rendered from it (--stream and --engine have no effect)",
+    )
+    parser.add_argument(
+        "--search",
+        metavar="QUERY",
+        help="With --archive, print the archived messages matching QUERY, best "
+        "match first, without contacting Slack (SQLite FTS5 syntax, e.g. "
+        '"deploy failed", deploy NOT staging, user:U123ABC)',
+    )
+    parser.add_argument(
+        "--search-limit",
+        type=int,
+        default=SEARCH_LIMIT,
+        help="With --search, maximum number of results (default: %i)" % SEARCH_LIMIT,
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="Write one JSON line per Slack API call to FILE: method, parameters, "
+        "status, latency, bytes, retries and rate-limit sleep",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="With -c or -r, report wall and CPU time spent fetching, rendering "
+        "and writing each conversation",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="With -c or -r and -o, continue the most recent interrupted export "
+        "from its last fetched page instead of starting over",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["sync", "async"],
+        default="sync",
+        help="With -c or -r, fetch using blocking threads or asyncio (requires aiohttp)",
     )
 
     a = parser.parse_args()
+    configure_session(a.pool_size, a.connect_timeout, a.read_timeout)
+    if a.trace:
+        api_trace = TraceLog(a.trace)
+    profiler.enabled = a.profile
+    rate_limiter.configure(headroom=a.rate_headroom)
     ts = str(datetime.strftime(datetime.now(), "%Y-%m-%d_%H%M%S"))
     sep_str = "*" * 24
 
@@ -509,95 +2294,489 @@ if __name__ == "__main__":
         print("If you specify --files you also need to specify an output directory with -o")
         sys.exit(1)
 
+    if a.o is None and a.jobs > 1:
+        # every conversation would be written to stdout at once
+        parser.error("--jobs greater than 1 needs an output directory with -o")
+
+    if a.search is not None:
+        if a.archive is None:
+            print("If you specify --search you also need to specify an archive with --archive")
+            sys.exit(1)
+        from archive import Archive
+
+        archive = Archive(a.archive)
+        if not archive.searchable:
+            print("Your SQLite library was built without FTS5, so --search is unavailable")
+            sys.exit(1)
+        results = archive.search(
+            a.search,
+            channels=[a.ch] if a.ch else None,
+            oldest=a.fr,
+            latest=a.to,
+            limit=a.search_limit,
+        )
+        if a.format == "text":
+            directory = Directory(archive.users(), archive.channels())
+            write_search_results(sys.stdout, results, directory)
+        else:
+            writer = json_writer(sys.stdout, a.format)
+            writer.write_all(results)
+            writer.close()
+        archive.close()
+        sys.exit(0)
+
     if a.o is not None:
         out_dir_parent = os.path.abspath(
             os.path.expanduser(os.path.expandvars(a.o))
         )
         out_dir = os.path.join(out_dir_parent, "slack_export_%s" % ts)
 
-    def save(data, filename):
+    if a.incremental:
+        if a.o is None:
+            print("If you specify --incremental you also need to specify an output directory with -o")
+            sys.exit(1)
+        # incremental exports live directly in -o, next to their state file
+        out_dir = out_dir_parent
+        os.makedirs(out_dir, exist_ok=True)
+        export_state = ExportState(os.path.join(out_dir, EXPORT_STATE_FILE))
+
+    if a.resume:
+        if a.o is None:
+            print("If you specify --resume you also need to specify an output directory with -o")
+            sys.exit(1)
+        if not a.incremental:
+            previous = sorted(
+                x
+                for x in glob.glob(os.path.join(out_dir_parent, "slack_export_*"))
+                if os.path.isdir(x)
+            )
+            if previous:
+                out_dir = previous[-1]
+                print("Resuming export in %s" % out_dir)
+            else:
+                print("No export to resume in %s, starting a new one" % out_dir_parent)
+
+    # every page fetched for -c/-r is journaled, so that --resume can pick up
+    # an interrupted run where it stopped
+    completed_channels = set()
+    completed_lock = threading.Lock()
+    if a.o is not None:
+        journal_dir = os.path.join(out_dir, ".journal")
+        completed_file = os.path.join(journal_dir, "completed")
+        if not a.resume:
+            shutil.rmtree(journal_dir, ignore_errors=True)
+        elif os.path.exists(completed_file):
+            with open(completed_file, encoding="utf-8") as f:
+                completed_channels = set(f.read().split())
+
+    def journals_for(channel_id):
+        if a.o is None:
+            return None
+        return JournalStore(os.path.join(journal_dir, channel_id))
+
+    def history_journal(channel_id):
+        journals = journals_for(channel_id)
+        return journals.journal("history") if journals else None
+
+    def finish_channel(channel_id):
+        """Remember a fully saved channel for --resume and drop its journals"""
+        if a.o is None:
+            return
+        with completed_lock:
+            os.makedirs(journal_dir, exist_ok=True)
+            with open(completed_file, mode="a", encoding="utf-8") as f:
+                f.write(channel_id + "\n")
+        journals_for(channel_id).discard()
+
+    def output_filename(name):
+        """The output's file name, with its format and compression extensions"""
+        filename = name + output_extension(a.format)
+        if a.compress:
+            filename += COMPRESSION_EXTENSIONS[a.compress]
+        return filename
+
+    def high_water_mark(name):
+        """Newest ts already in the named output (--incremental)
+
+        Marks are kept per file name and format, so switching --format or
+        --compress starts the file over. A deleted file, or one changed since
+        its mark was saved, is exported in full again.
+        """
+        if not a.incremental:
+            return None
+        filename = output_filename(name)
+        try:
+            size = os.path.getsize(os.path.join(out_dir, filename))
+        except FileNotFoundError:
+            return None
+        return export_state.latest_ts(filename, a.format, size)
+
+    @contextmanager
+    def open_output(name, merge=False):
+        """Open an output file; with merge and --incremental, the new data is
+        written next to the existing file and then prepended to it"""
         if a.o is None:
-            json.dump(data, sys.stdout, indent=4)
+            yield profiler.writer(sys.stdout)
+            return
+        os.makedirs(out_dir, exist_ok=True)
+        full_filepath = os.path.join(out_dir, output_filename(name))
+        print("Writing output to %s" % full_filepath)
+        # without a mark, the file is not from an incremental run: replace it
+        if merge and high_water_mark(name) is not None:
+            new_filepath = with_suffix(full_filepath, ".new")
+            with open_file(new_filepath, mode="w") as f:
+                yield profiler.writer(f)
+            with profiler.phase("write"):
+                merge_export(new_filepath, full_filepath, sep_str)
         else:
-            filename = filename + ".json" if a.json else filename + ".txt"
-            os.makedirs(out_dir, exist_ok=True)
-            full_filepath = os.path.join(out_dir, filename)
-            print("Writing output to %s" % full_filepath)
-            with open(full_filepath, mode="w", encoding="utf-8") as f:
-                if a.json:
-                    json.dump(data, f, indent=4)
-                else:
-                    f.write(data)
+            with open_file(full_filepath, mode="w") as f:
+                yield profiler.writer(f)
+
+    def save(data, filename, render, merge=False, threads=False):
+        """Write data in a JSON format, or as text by calling render(fh, data)
+
+        With threads, data is a list of reply threads.
+        """
+        with open_output(filename, merge) as f, profiler.phase("render"):
+            if a.format == "text":
+                render(f, data)
+            else:
+                writer = json_writer(f, a.format)
+                for item in data:
+                    if threads:
+                        writer.write_thread(item)
+                    else:
+                        writer.write(item)
+                writer.close()
+
+    def since(names):
+        """Oldest ts to fetch: --fr, raised to the outputs' high-water mark"""
+        oldest = a.fr
+        if a.incremental:
+            marks = [high_water_mark(name) for name in names]
+            if None not in marks:
+                mark = min(marks, key=float)
+                if oldest is None or float(mark) > float(oldest):
+                    oldest = mark
+        return oldest
+
+    def unseen(msgs, mark):
+        """Leave out messages at or before an output's high-water mark"""
+        if mark is None:
+            return msgs
+        return [x for x in msgs if float(x["ts"]) > float(mark)]
+
+    def mark_exported(name, ts):
+        if a.incremental:
+            filename = output_filename(name)
+            size = os.path.getsize(os.path.join(out_dir, filename))
+            export_state.update(filename, ts, a.format, size)
+
+    def output_names(channel_id, history=True, replies=False):
+        names = ["channel_%s" % channel_id] if history else []
+        return names + (["channel-replies_%s" % channel_id] if replies else [])
+
+    if a.engine == "async":
+        # let async_exporter share this module's state instead of importing
+        # a second copy of exporter.py
+        sys.modules.setdefault("exporter", sys.modules[__name__])
+        import async_exporter
+
+    archive = None
+    if a.archive:
+        from archive import Archive
+
+        archive = Archive(a.archive)
+
+    def fetch_history(channel_id, oldest):
+        journal = history_journal(channel_id)
+        if archive is not None:
+            return archived_history(
+                archive, channel_id, oldest=oldest, latest=a.to, journal=journal
+            )
+        if a.engine == "async":
+            return async_exporter.run(
+                async_exporter.channel_history(
+                    channel_id, oldest=oldest, latest=a.to, journal=journal
+                )
+            )
+        return channel_history(channel_id, oldest=oldest, latest=a.to, journal=journal)
+
+    def fetch_replies(timestamps, channel_id):
+        journals = journals_for(channel_id)
+        if archive is not None:
+            return archived_replies(
+                archive,
+                timestamps,
+                channel_id,
+                workers=a.reply_workers,
+                journals=journals,
+            )
+        if a.engine == "async":
+            return async_exporter.run(
+                async_exporter.channel_replies(timestamps, channel_id, journals=journals)
+            )
+        return iter_channel_replies(
+            timestamps, channel_id, workers=a.reply_workers, journals=journals
+        )
 
-    def save_replies(channel_hist, channel_id, channel_list, users):
+    def save_replies(channel_hist, channel_id, directory):
+        name = "channel-replies_%s" % channel_id
+        newest = newest_ts(channel_hist)
+        channel_hist = unseen(channel_hist, high_water_mark(name))
         reply_timestamps = [x["ts"] for x in channel_hist if "reply_count" in x]
-        ch_replies = channel_replies(reply_timestamps, channel_id)
-        if a.json:
-            data_replies = ch_replies
-        else:
-            ch_name, ch_type = name_from_ch_id(channel_id, channel_list)
-            header_str = "Threads in %s: %s\n%s Messages" % (
-                ch_type,
-                ch_name,
-                len(ch_replies),
+        with profiler.phase("fetch"):
+            ch_replies = list(fetch_replies(reply_timestamps, channel_id))
+
+        def render(f, threads):
+            ch_name, ch_type = name_from_ch_id(channel_id, directory)
+            f.write(
+                "Threads in %s: %s\n%s Messages\n%s\n\n"
+                % (ch_type, ch_name, len(threads), sep_str)
             )
-            data_replies = parse_replies(ch_replies, users)
-            data_replies = "%s\n%s\n\n%s" % (header_str, sep_str, data_replies)
-        save(data_replies, "channel-replies_%s" % channel_id)
+            write_replies(f, threads, directory)
 
-    def save_channel(channel_hist, channel_id, channel_list, users):
-        if a.json:
-            data_ch = channel_hist
-        else:
-            data_ch = parse_channel_history(channel_hist, users)
-            ch_name, ch_type = name_from_ch_id(channel_id, channel_list)
-            header_str = "%s Name: %s" % (ch_type, ch_name)
-            data_ch = (
-                "Channel ID: %s\n%s\n%s Messages\n%s\n\n"
-                % (channel_id, header_str, len(channel_hist), sep_str)
-                + data_ch
+        save(ch_replies, name, render, merge=True, threads=True)
+        mark_exported(name, newest)
+
+    def save_channel(channel_hist, channel_id, directory):
+        name = "channel_%s" % channel_id
+        all_hist = channel_hist
+        channel_hist = unseen(channel_hist, high_water_mark(name))
+
+        def render(f, msgs):
+            ch_name, ch_type = name_from_ch_id(channel_id, directory)
+            f.write(
+                "Channel ID: %s\n%s Name: %s\n%s Messages\n%s\n\n"
+                % (channel_id, ch_type, ch_name, len(msgs), sep_str)
+            )
+            write_channel_history(f, msgs, directory)
+
+        save(channel_hist, name, render, merge=True)
+        mark_exported(name, newest_ts(all_hist))
+        if a.r:
+            save_replies(all_hist, channel_id, directory)
+
+    def stream_replies(reply_timestamps, channel_id, directory, newest=None):
+        """Write reply threads one at a time as they are fetched
+
+        newest is the newest message ts that was scanned for threads.
+        """
+        name = "channel-replies_%s" % channel_id
+        with open_output(name, merge=True) as f, profiler.phase("render"):
+            if a.format != "text":
+                writer = json_writer(f, a.format)
+            else:
+                ch_name, ch_type = name_from_ch_id(channel_id, directory)
+                f.write(
+                    "Threads in %s: %s\n%s Messages\n%s\n\n"
+                    % (ch_type, ch_name, len(reply_timestamps), sep_str)
+                )
+            threads = fetch_replies(reply_timestamps, channel_id)
+            for thread in profiler.iterate("fetch", threads):
+                if a.format != "text":
+                    writer.write_thread(thread)
+                else:
+                    write_replies(f, [thread], directory)
+            if a.format != "text":
+                writer.close()
+        mark_exported(name, newest)
+
+    def stream_channel(channel_id, directory):
+        """Write the channel's history page by page as it is fetched
+
+        Only the parent timestamps of threads are kept in memory. The message
+        count is not known until the end, so text output has it as a trailer.
+        """
+        name = "channel_%s" % channel_id
+        replies_name = "channel-replies_%s" % channel_id
+        oldest = since(output_names(channel_id, replies=a.r))
+        # read before the output file is (re)created below
+        mark = high_water_mark(name)
+        replies_mark = high_water_mark(replies_name)
+        reply_timestamps = []
+        num_msgs = 0
+        newest = None
+        with open_output(name, merge=True) as f, profiler.phase("render"):
+            if a.format != "text":
+                writer = json_writer(f, a.format)
+            else:
+                ch_name, ch_type = name_from_ch_id(channel_id, directory)
+                f.write(
+                    "Channel ID: %s\n%s Name: %s\n%s\n\n"
+                    % (channel_id, ch_type, ch_name, sep_str)
+                )
+            pages = iter_channel_history(
+                channel_id,
+                oldest=oldest,
+                latest=a.to,
+                journal=history_journal(channel_id),
             )
-        save(data_ch, "channel_%s" % channel_id)
+            for page in profiler.iterate("fetch", pages):
+                reply_timestamps.extend(
+                    x["ts"] for x in unseen(page, replies_mark) if "reply_count" in x
+                )
+                newest = newest_ts(page + ([{"ts": newest}] if newest else []))
+                page = unseen(page, mark)
+                num_msgs += len(page)
+                if a.format != "text":
+                    writer.write_all(page)
+                else:
+                    write_channel_history(f, page, directory)
+            if a.format != "text":
+                writer.close()
+            else:
+                f.write("%s Messages\n" % num_msgs)
+        mark_exported(name, newest)
         if a.r:
-            save_replies(channel_hist, channel_id, channel_list, users)
+            stream_replies(reply_timestamps, channel_id, directory, newest)
 
-    ch_list = channel_list()
-    user_list = user_list()
+    metadata_cache.ttl = a.cache_ttl
+    ch_list = cached_channel_list(refresh=a.refresh_cache)
+    user_list = cached_user_list(refresh=a.refresh_cache)
+    directory = Directory(user_list, ch_list)
+    if archive is not None:
+        archive.store_channels(ch_list)
+        archive.store_users(user_list)
 
     if a.lc:
-        data = ch_list if a.json else parse_channel_list(ch_list, user_list)
-        save(data, "channel_list")
+        save(
+            ch_list,
+            "channel_list",
+            lambda f, channels: write_channel_list(f, channels, directory),
+        )
     if a.lu:
-        data = user_list if a.json else parse_user_list(user_list)
-        save(data, "user_list")
+        save(user_list, "user_list", write_user_list)
+
+    def allowed_channel_ids():
+        allowed_channels = get_allowed_channels()
+        ch_ids = []
+        for ch_id in [x["id"] for x in ch_list]:
+            # Check if channel is allowed (skip if no restrictions or if channel is in allowed list)
+            if allowed_channels and ch_id not in allowed_channels:
+                print(f"⏭️  Skipping unauthorized channel: {ch_id}")
+                continue
+            ch_ids.append(ch_id)
+        return ch_ids
+
+    failed_channels = []
+
+    def export_all(channel_ids, export):
+        """Run export(channel_id) for every channel, up to a.jobs at once
+
+        A failing channel (including the sys.exit calls in get_at_cursor) is
+        recorded in failed_channels and does not stop the others.
+        """
+
+        def run(channel_id):
+            try:
+                export(channel_id)
+            except (Exception, SystemExit) as e:
+                print(f"❌ Failed to export {channel_id}: {e!r}")
+                failed_channels.append((channel_id, e))
+
+        if a.jobs <= 1:
+            for channel_id in channel_ids:
+                run(channel_id)
+        else:
+            with ThreadPoolExecutor(max_workers=a.jobs) as executor:
+                list(executor.map(run, channel_ids))
+
+    def export_channel(channel_id):
+        if channel_id in completed_channels:
+            print("⏭️  Already exported: %s" % channel_id)
+            return
+        with profiler.channel(channel_id):
+            if a.stream and archive is None:
+                stream_channel(channel_id, directory)
+            else:
+                oldest = since(output_names(channel_id, replies=a.r))
+                with profiler.phase("fetch"):
+                    ch_hist = fetch_history(channel_id, oldest)
+                save_channel(ch_hist, channel_id, directory)
+        finish_channel(channel_id)
+
+    def export_replies(channel_id):
+        if channel_id in completed_channels:
+            print("⏭️  Already exported: %s" % channel_id)
+            return
+        oldest = since(output_names(channel_id, history=False, replies=True))
+        with profiler.channel(channel_id):
+            if a.stream and archive is None:
+                mark = high_water_mark("channel-replies_%s" % channel_id)
+                reply_timestamps = []
+                newest = None
+                pages = iter_channel_history(
+                    channel_id,
+                    oldest=oldest,
+                    latest=a.to,
+                    journal=history_journal(channel_id),
+                )
+                for page in profiler.iterate("fetch", pages):
+                    reply_timestamps.extend(
+                        x["ts"] for x in unseen(page, mark) if "reply_count" in x
+                    )
+                    newest = newest_ts(page + ([{"ts": newest}] if newest else []))
+                stream_replies(reply_timestamps, channel_id, directory, newest)
+            else:
+                with profiler.phase("fetch"):
+                    ch_hist = fetch_history(channel_id, oldest)
+                save_replies(ch_hist, channel_id, directory)
+        finish_channel(channel_id)
+
     if a.c:
         ch_id = a.ch
         if ch_id:
             # Check if channel is allowed
             if not is_channel_allowed(ch_id):
                 print(f"❌ Channel {ch_id} is not authorized for export")
-                continue
-            ch_hist = channel_history(ch_id, oldest=a.fr, latest=a.to)
-            save_channel(ch_hist, ch_id, ch_list, user_list)
+                sys.exit(1)
+            export_channel(ch_id)
         else:
-            allowed_channels = get_allowed_channels()
-            for ch_id in [x["id"] for x in ch_list]:
-                # Check if channel is allowed (skip if no restrictions or if channel is in allowed list)
-                if allowed_channels and not is_channel_allowed(ch_id):
-                    print(f"⏭️  Skipping unauthorized channel: {ch_id}")
-                    continue
-                ch_hist = channel_history(ch_id, oldest=a.fr, latest=a.to)
-                save_channel(ch_hist, ch_id, ch_list, user_list)
+            export_all(allowed_channel_ids(), export_channel)
     # elif, since we want to avoid asking for channel_history twice
     elif a.r:
-        allowed_channels = get_allowed_channels()
-        for ch_id in [x["id"] for x in channel_list()]:
-            # Check if channel is allowed (skip if no restrictions or if channel is in allowed list)
-            if allowed_channels and not is_channel_allowed(ch_id):
-                print(f"⏭️  Skipping unauthorized channel: {ch_id}")
-                continue
-            ch_hist = channel_history(ch_id, oldest=a.fr, latest=a.to)
-            save_replies(ch_hist, ch_id, ch_list, user_list)
+        export_all(allowed_channel_ids(), export_replies)
 
     if a.files and a.o is not None:
-        save_files(out_dir)
+        if a.files_channel and not is_channel_allowed(a.files_channel):
+            print(f"❌ Channel {a.files_channel} is not authorized for export")
+            sys.exit(1)
+        file_filters = {
+            "channel": a.files_channel,
+            "user": a.files_user,
+            "types": a.files_types,
+            "ts_from": a.files_from,
+            "ts_to": a.files_to,
+            "max_size": a.files_max_size,
+        }
+        save_files(
+            os.path.join(out_dir_parent, FILES_DIR),
+            workers=a.file_workers,
+            verify=a.verify_files,
+            filters=file_filters,
+            archive=archive,
+        )
+
+    if archive is not None:
+        archive.close()
+
+    print(rate_limiter.report(), file=sys.stderr)
+    print(metadata_cache.report(), file=sys.stderr)
+    if a.profile:
+        print(profiler.report(), file=sys.stderr)
+    if api_trace is not None:
+        api_trace.close()
+        print(
+            "Traced %i API calls to %s" % (api_trace.records, api_trace.path),
+            file=sys.stderr,
+        )
+
+    if a.o is not None and not failed_channels:
+        shutil.rmtree(journal_dir, ignore_errors=True)
+
+    if failed_channels:
+        print("⚠️  %i channel(s) failed to export:" % len(failed_channels))
+        for ch_id, err in failed_channels:
+            print(f"  - {ch_id}: {err!r}")
+        sys.exit(1)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Background jobs for Slack Exporter's bot.
+
+Slack expects a slash command to be answered within 3 seconds, so bot.py
+acknowledges the command at once and queues the export here. A fixed number
+of worker threads run the queued jobs; once the queue is full, new jobs are
+refused instead of piling up behind a large export.
+"""
+
+import os
+import queue
+import threading
+
+# exports run at once, and exports waiting for a worker, per bot process
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", 2))
+EXPORT_QUEUE_SIZE = int(os.environ.get("EXPORT_QUEUE_SIZE", 20))
+
+
+class JobQueue:
+    """Bounded queue of jobs run by a pool of daemon threads
+
+    The threads are started by the first submit, so each gunicorn worker
+    starts its own pool after forking.
+    """
+
+    def __init__(self, workers=None, max_queued=None):
+        self.workers = max(1, EXPORT_WORKERS if workers is None else workers)
+        self.max_queued = EXPORT_QUEUE_SIZE if max_queued is None else max_queued
+        self._queue = queue.Queue(maxsize=max(1, self.max_queued))
+        self._lock = threading.Lock()
+        self._threads = []
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._work,
+                    name="export-%i" % len(self._threads),
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, func, *args, on_error=None, **kwargs):
+        """Queue func(*args, **kwargs); returns False if the queue is full
+
+        on_error(exception) is called in the worker if the job raises,
+        including SystemExit from the exporter's error handling.
+        """
+        self._start()
+        try:
+            self._queue.put_nowait((func, args, kwargs, on_error))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        return True
+
+    def _work(self):
+        while True:
+            func, args, kwargs, on_error = self._queue.get()
+            with self._lock:
+                self.running += 1
+            try:
+                func(*args, **kwargs)
+            except (Exception, SystemExit) as e:
+                print(f"❌ Background job failed: {e!r}")
+                with self._lock:
+                    self.failed += 1
+                if on_error is not None:
+                    try:
+                        on_error(e)
+                    except Exception as err:
+                        print(f"❌ Error handler failed: {err!r}")
+            else:
+                with self._lock:
+                    self.completed += 1
+            finally:
+                with self._lock:
+                    self.running -= 1
+                self._queue.task_done()
+
+    def join(self):
+        """Wait until every queued job has finished"""
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queued": self.max_queued,
+                "queued": self._queue.qsize(),
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+            }
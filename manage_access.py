@@ -5,10 +5,12 @@ Use this script to manage which users and channels are allowed to use the export
 """
 
 import argparse
+import json
 import sys
 from config import (
     add_allowed_user, remove_allowed_user, add_allowed_channel, remove_allowed_channel,
-    list_allowed_users, list_allowed_channels, clear_allowed_users, clear_allowed_channels
+    list_allowed_users, list_allowed_channels, clear_allowed_users, clear_allowed_channels,
+    update_allowed_users, update_allowed_channels, replace_allowlists
 )
 
 def print_users():
@@ -85,6 +87,50 @@ def clear_channels():
         print("❌ Failed to clear channels")
         sys.exit(1)
 
+def read_ids(path):
+    """Read IDs from a file: one per line (or separated by commas or spaces,
+    # starts a comment), a JSON list, or the legacy {"items": [...]} JSON"""
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    
+    if text.lstrip()[:1] in ('[', '{'):
+        data = json.loads(text)
+        ids = data.get('items', []) if isinstance(data, dict) else data
+        if not isinstance(ids, list) or not all(isinstance(x, str) for x in ids):
+            raise ValueError("expected a JSON list of ID strings")
+        return ids
+    
+    ids = []
+    for line in text.splitlines():
+        ids.extend(line.split('#', 1)[0].replace(',', ' ').split())
+    return ids
+
+def import_ids(path, replace=False):
+    """Add the user (U...) and channel (C...) IDs in a file, in one
+    transaction per list; with replace, they become the whole lists in a
+    single transaction"""
+    try:
+        ids = read_ids(path)
+    except (OSError, ValueError) as e:
+        print(f"❌ Could not read {path}: {e}")
+        sys.exit(1)
+    
+    users = [x for x in ids if x.startswith('U')]
+    channels = [x for x in ids if x.startswith('C')]
+    invalid = [x for x in ids if not x.startswith(('U', 'C'))]
+    if invalid:
+        print(f"❌ Not a user or channel ID: {', '.join(invalid[:10])}{' ...' if len(invalid) > 10 else ''}")
+        sys.exit(1)
+    
+    if replace:
+        num_users, num_channels = replace_allowlists(users, channels)
+        print(f"✅ Allowed users replaced: {num_users} users")
+        print(f"✅ Allowed channels replaced: {num_channels} channels")
+    else:
+        added_users = update_allowed_users(add=users)[0]
+        added_channels = update_allowed_channels(add=channels)[0]
+        print(f"✅ Imported {added_users} new users and {added_channels} new channels from {path}")
+
 def main():
     parser = argparse.ArgumentParser(
         description="Manage Slack Exporter access control",
@@ -111,6 +157,12 @@ Examples:
 
   # Clear all channels
   python manage_access.py --clear-channels
+
+  # Allow every user and channel ID listed in a file (one per line)
+  python manage_access.py --import ids.txt
+
+  # Make the file's IDs the complete allowlists
+  python manage_access.py --import ids.txt --replace
         """
     )
 
@@ -124,6 +176,13 @@ Examples:
     parser.add_argument("--remove-channel", help="Remove a channel ID from the allowed list")
     parser.add_argument("--clear-channels", action="store_true", help="Clear all allowed channels")
 
+    # Bulk management
+    parser.add_argument("--import", dest="import_file", metavar="FILE",
+                        help="Allow all user (U...) and channel (C...) IDs in FILE: one per line, a JSON list, "
+                             "or an allowed_*.json file")
+    parser.add_argument("--replace", action="store_true",
+                        help="With --import, replace both allowlists with the IDs in FILE")
+
     # Display options
     parser.add_argument("--list", action="store_true", help="List all allowed users and channels")
     parser.add_argument("--users-only", action="store_true", help="List only allowed users")
@@ -148,6 +207,15 @@ Examples:
         print_channels()
         return
 
+    if args.import_file:
+        if args.replace:
+            confirm = input("Are you sure you want to replace all allowed users and channels? (y/N): ")
+            if confirm.lower() != 'y':
+                print("Operation cancelled")
+                return
+        import_ids(args.import_file, replace=args.replace)
+        return
+
     # Handle user management
     if args.add_user:
         add_user(args.add_user)
@@ -123,6 +123,125 @@ def test_persistence():
     
     print("✅ Data persistence working correctly")
 
+def test_allowlist_cache():
+    """Test that allowlists are read once and re-read when they change"""
+    print("\n🧪 Testing Allowlist Cache")
+    print("-" * 30)
+    
+    import config
+    from access_store import AllowlistStore
+    
+    clear_allowed_channels()
+    add_allowed_channel("C099EEMH26N")
+    
+    reads = []
+    conn = config._store._connection()
+    conn.set_trace_callback(lambda sql: reads.append(sql) if "SELECT id" in sql else None)
+    other_worker = AllowlistStore(config.ACCESS_DB_FILE)
+    try:
+        for _ in range(10000):
+            assert is_channel_allowed("C099EEMH26N"), "Allowed channel should be permitted"
+        assert len(reads) <= 1, f"Allowlist read {len(reads)} times"
+        print("✅ 10,000 lookups read the allowlist at most once")
+        
+        # another process changing the store is noticed
+        other_worker.replace(config.CHANNELS, ["C0000000001", "C0000000002"])
+        assert not is_channel_allowed("C099EEMH26N"), "Stale allowlist after external change"
+        assert is_channel_allowed("C0000000002"), "External change not picked up"
+        print("✅ Changes made outside this process are picked up")
+        
+        # writes through config invalidate the cache at once
+        add_allowed_channel("C099EEMH26N")
+        assert is_channel_allowed("C099EEMH26N"), "Cache not invalidated on write"
+        print("✅ Writes invalidate the cache")
+    finally:
+        conn.set_trace_callback(None)
+        other_worker.close()
+        clear_allowed_channels()
+
+def test_bulk_operations():
+    """Test transactional bulk changes and concurrent writers"""
+    print("\n🧪 Testing Bulk Operations")
+    print("-" * 30)
+    
+    import tempfile
+    import threading
+    import config
+    from access_store import AllowlistStore
+    
+    channels = ["C%09i" % i for i in range(5000)]
+    assert config.replace_allowed_channels(channels) == 5000, "Replace failed"
+    assert config.update_allowed_channels(add=["C099EEMH26N"], remove=channels[:100]) == (1, 100)
+    assert len(list_allowed_channels()) == 4901, "Wrong number of channels"
+    print("✅ Bulk add, remove and replace")
+    
+    try:
+        config.update_allowed_channels(add=["C099EEMH26N", "bad"], remove=channels)
+        assert False, "Should reject invalid channel IDs"
+    except ValueError:
+        pass
+    assert len(list_allowed_channels()) == 4901, "Rejected bulk change was applied"
+    print("✅ A bulk change with an invalid ID changes nothing")
+    
+    users = list_allowed_users()
+    try:
+        config.replace_allowlists(["U1"], ["C1", "bad"])
+        assert False, "Should reject invalid channel IDs"
+    except ValueError:
+        pass
+    assert list_allowed_users() == users, "Users replaced although channels failed"
+    assert config.replace_allowlists(["U1"], ["C1", "C2"]) == (1, 2)
+    assert list_allowed_users() == ["U1"] and list_allowed_channels() == ["C1", "C2"]
+    config.replace_allowed_users(users)
+    print("✅ Both allowlists are replaced in one transaction")
+    
+    import manage_access
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "ids.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('["U1", 42]')
+        try:
+            manage_access.read_ids(path)
+            assert False, "Should reject non-string IDs"
+        except ValueError:
+            pass
+        try:
+            manage_access.import_ids(path)
+            assert False, "Should exit on non-string IDs"
+        except SystemExit as e:
+            assert e.code == 1, e.code
+    print("✅ Imports with non-string IDs are rejected cleanly")
+    clear_allowed_channels()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = os.path.join(tmp, "allowed_users.json")
+        with open(legacy, 'w', encoding='utf-8') as f:
+            f.write('{"items": ["U1", "U2"]}')
+        path = os.path.join(tmp, "access.db")
+        store = AllowlistStore(path, legacy_files={"users": legacy})
+        assert store.items("users") == {"U1", "U2"}, "Legacy JSON not imported"
+        store.remove("users", ["U1"])
+        store.close()
+        store = AllowlistStore(path, legacy_files={"users": legacy})
+        assert store.items("users") == {"U2"}, "Legacy JSON imported twice"
+        print("✅ The legacy JSON allowlist is imported once")
+        
+        # one store per thread stands in for one connection per gunicorn worker
+        def worker(n):
+            own = AllowlistStore(path)
+            for i in range(50):
+                own.add("users", ["U%i_%i" % (n, i)])
+            own.close()
+        
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(store.items("users")) == 201, "Concurrent writes were lost"
+        store.close()
+        print("✅ Concurrent writers do not lose updates")
+
 def main():
     """Run all tests"""
     print("🔧 Testing Slack Exporter Access Control")
@@ -133,6 +252,8 @@ def main():
         test_channel_management()
         test_access_control()
         test_persistence()
+        test_allowlist_cache()
+        test_bulk_operations()
         
         print("\n" + "=" * 50)
         print("✅ All tests passed! Access control is working correctly.")
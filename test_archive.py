@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Test script for the SQLite message archive.
+"""
+
+import os
+import sys
+import sqlite3
+import tempfile
+
+from archive import Archive
+
+
+def message(ts, **fields):
+    return dict({"type": "message", "ts": ts, "user": "U1", "text": "msg %s" % ts}, **fields)
+
+
+def test_history():
+    """Test storing and reading back a channel's history"""
+    print("🧪 Testing Archived History")
+    print("-" * 30)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = Archive(os.path.join(tmp, "archive.db"))
+        archive.store_messages("C1", [message("3.0"), message("1.0")])
+        archive.store_messages("C1", [message("2.0"), message("3.0", text="edited")])
+        archive.store_messages("C2", [message("5.0")])
+
+        history = archive.history("C1")
+        assert [m["ts"] for m in history] == ["3.0", "2.0", "1.0"], history
+        assert history[0]["text"] == "edited", "Update not applied"
+        assert [m["ts"] for m in archive.history("C1", oldest="1.0", latest="3.0")] == ["2.0"]
+        assert archive.count_messages() == 4 and archive.count_messages("C2") == 1
+        print("✅ History is newest first, bounded and keyed by (channel, ts)")
+
+        archive.close()
+        archive = Archive(os.path.join(tmp, "archive.db"))
+        assert len(archive.history("C1")) == 3, "Archive not persisted"
+        archive.close()
+        print("✅ The archive persists across connections")
+
+
+def test_threads():
+    """Test thread storage and detection of threads that need fetching"""
+    print("\n🧪 Testing Archived Threads")
+    print("-" * 30)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = Archive(os.path.join(tmp, "archive.db"))
+        parent = message("1.0", thread_ts="1.0", reply_count=2, latest_reply="1.2")
+        archive.store_messages("C1", [parent, message("2.0")])
+        assert archive.stale_threads("C1", ["1.0"]) == ["1.0"], "Unfetched thread"
+
+        replies = [message("1.1", thread_ts="1.0"), message("1.2", thread_ts="1.0")]
+        archive.store_thread("C1", "1.0", [parent] + replies)
+        assert [m["ts"] for m in archive.thread("C1", "1.0")] == ["1.0", "1.1", "1.2"]
+        assert [m["ts"] for m in archive.history("C1")] == ["2.0", "1.0"], "Replies in history"
+        assert archive.stale_threads("C1", ["1.0"]) == [], "Fresh thread is stale"
+        print("✅ Replies are kept out of the history and read back in order")
+
+        newer = dict(parent, reply_count=3, latest_reply="1.3")
+        archive.store_messages("C1", [newer])
+        assert archive.stale_threads("C1", ["1.0"]) == ["1.0"], "New reply not noticed"
+        assert archive.history("C1")[1]["reply_count"] == 3
+        print("✅ Threads with new replies are fetched again")
+
+        archive._conn.execute("ALTER TABLE threads RENAME TO threads_old")
+        try:
+            archive.store_thread("C1", "5.0", [message("5.0"), message("5.1", thread_ts="5.0")])
+            assert False, "Expected the thread bookkeeping to fail"
+        except sqlite3.OperationalError:
+            pass
+        archive._conn.execute("ALTER TABLE threads_old RENAME TO threads")
+        assert archive.thread("C1", "5.0") == [], "Messages kept without their thread"
+        print("✅ A thread and its messages are stored in one transaction")
+        archive.close()
+
+
+def test_metadata():
+    """Test users, conversations and file metadata"""
+    print("\n🧪 Testing Archived Metadata")
+    print("-" * 30)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = Archive(os.path.join(tmp, "archive.db"))
+        archive.store_users([{"id": "U1", "name": "alice"}])
+        archive.store_users([{"id": "U1", "name": "alice2"}, {"id": "U2", "name": "bob"}])
+        archive.store_channels([{"id": "C1", "name": "general"}])
+        archive.store_files([{"id": "F1", "created": 1, "size": 10, "name": "a.png"},
+                             {"id": "F2", "created": 2, "size": 20, "name": "b.png"}])
+        assert sorted(u["name"] for u in archive.users()) == ["alice2", "bob"]
+        assert archive.channels() == [{"id": "C1", "name": "general"}]
+        assert [f["id"] for f in archive.files()] == ["F2", "F1"]
+        assert archive.latest_ts("C1") is None, "Unexpected mark"
+        archive.set_latest_ts("C1", "5.0")
+        archive.set_latest_ts("C1", "6.0")
+        assert archive.latest_ts("C1") == "6.0"
+        archive.close()
+        print("✅ Users, conversations, files and sync marks are stored")
+
+
+def test_search():
+    """Test the full-text index and ranked search"""
+    print("\n🧪 Testing Archive Search")
+    print("-" * 30)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "archive.db")
+        archive = Archive(path)
+        if not archive.searchable:
+            print("⚠️ SQLite has no FTS5, skipping")
+            archive.close()
+            return
+
+        archive.store_messages("C1", [
+            message("1.0", text="deploy failed again"),
+            message("2.0", text="lunch?"),
+            message("3.0", text="the deploy is done, deploy deploy"),
+        ])
+        archive.store_messages("C2", [message("4.0", text="deploy notes", user="U2")])
+
+        hits = archive.search("deploy")
+        assert [m["ts"] for m in hits][0] == "3.0", "Not ranked by bm25"
+        assert sorted(m["ts"] for m in hits) == ["1.0", "3.0", "4.0"], hits
+        assert hits[0]["channel"] == "C1" and "**deploy**" in hits[0]["snippet"]
+        assert [m["ts"] for m in archive.search("deploy", channels=["C2"])] == ["4.0"]
+        assert [m["ts"] for m in archive.search("deploy", oldest=2, latest=3.5)] == ["3.0"]
+        assert [m["ts"] for m in archive.search("deploy AND user:U2")] == ["4.0"]
+        assert [m["ts"] for m in archive.search("lunch?")] == ["2.0"], "Plain words fallback"
+        assert sorted(m["ts"] for m in archive.search('deploy AND "')) == ["1.0", "3.0", "4.0"], \
+            "Unbalanced quote not dropped"
+        assert archive.search('" ( *') == [], "Query without words should match nothing"
+        print("✅ Results are ranked and filtered by channel and date")
+
+        archive.store_messages("C1", [message("2.0", text="dinner")])
+        assert archive.search("lunch") == [], "Edited text still indexed"
+        assert [m["ts"] for m in archive.search("dinner")] == ["2.0"]
+        print("✅ Edits are reindexed incrementally")
+        archive.close()
+
+        # an archive made before the index existed is indexed when opened
+        conn = sqlite3.connect(path)
+        conn.executescript(
+            "DROP TRIGGER messages_fts_insert; DROP TRIGGER messages_fts_delete;"
+            "DROP TRIGGER messages_fts_update; DROP TABLE messages_fts;"
+        )
+        conn.close()
+        archive = Archive(path)
+        assert len(archive.search("deploy")) == 3, "Old archive not indexed"
+        archive.close()
+        print("✅ Existing archives are indexed on first open")
+
+
+def main():
+    """Run all tests"""
+    print("🔧 Testing SQLite Archive")
+    print("=" * 50)
+
+    try:
+        test_history()
+        test_threads()
+        test_metadata()
+        test_search()
+
+        print("\n" + "=" * 50)
+        print("✅ All tests passed!")
+
+    except AssertionError as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
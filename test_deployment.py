@@ -100,6 +100,36 @@ def test_flask_app():
         print(f"❌ Flask app test failed: {e}")
         return False
 
+def test_partial_exports():
+    """Test that unfinished exports are neither counted nor served"""
+    print("\n🧪 Testing partial exports...")
+
+    import tempfile
+    import bot
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "team-ch_C1-abc123.json.gz")
+        try:
+            with bot.write_export(path) as f:
+                f.write("[")
+                assert os.listdir(tmp) == ["team-ch_C1-abc123.json.part.gz"], os.listdir(tmp)
+                raise RuntimeError("export failed")
+        except RuntimeError:
+            pass
+        assert os.listdir(tmp) == [], "Partial export left behind"
+
+        with bot.write_export(path) as f:
+            f.write("[]")
+        assert os.listdir(tmp) == [os.path.basename(path)], os.listdir(tmp)
+
+    assert bot.is_partial_export("team-ch_C1-abc123.json.part.gz")
+    assert not bot.is_partial_export("team-ch_C1-abc123.json.gz")
+    with bot.app.test_client() as client:
+        response = client.get("/download/team-ch_C1-abc123.json.part.gz")
+        assert response.status_code == 404, response.status_code
+    print("✅ Exports appear only once complete")
+    return True
+
 def test_environment():
     """Test environment setup"""
     print("\n🧪 Testing environment...")
@@ -140,6 +170,10 @@ def main():
     if not test_flask_app():
         all_tests_passed = False
     
+    # Test partial exports
+    if not test_partial_exports():
+        all_tests_passed = False
+
     # Test environment
     if not test_environment():
         all_tests_passed = False
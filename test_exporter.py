@@ -0,0 +1,955 @@
+#!/usr/bin/env python3
+"""
+Test script for the exporter's offline building blocks.
+These tests never talk to Slack; a dummy token is used if none is set.
+"""
+
+import os
+import sys
+import threading
+
+os.environ.setdefault("SLACK_USER_TOKEN", "xoxp-test")
+
+import exporter
+
+
+def test_shared_session():
+    """Test that all Slack traffic shares one pooled session"""
+    print("🧪 Testing HTTP Session Pooling")
+    print("-" * 30)
+
+    session = exporter.get_session()
+    assert exporter.get_session() is session, "Session should be reused"
+    adapter = session.get_adapter("https://slack.com/api/users.list")
+    assert adapter._pool_maxsize == exporter.HTTP_POOL_SIZE, "Wrong pool size"
+    print("✅ Session is shared and pooled")
+
+    old_pool_size = exporter.HTTP_POOL_SIZE
+    old_timeout = exporter.http_timeout()
+    exporter.configure_session(pool_size=4, read_timeout=5)
+    try:
+        assert exporter.get_session() is not session, "Session should be rebuilt"
+        adapter = exporter.get_session().get_adapter("https://slack.com/api/")
+        assert adapter._pool_maxsize == 4, "Pool size not applied"
+        assert exporter.http_timeout() == (old_timeout[0], 5), "Timeout not applied"
+        print("✅ Pool size and timeouts are configurable")
+    finally:
+        exporter.configure_session(
+            pool_size=old_pool_size, connect_timeout=old_timeout[0], read_timeout=old_timeout[1]
+        )
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.reason = "fake"
+        self.headers = headers or {}
+        self._data = data if data is not None else {"ok": True}
+        self.content = b"{}"
+
+    def json(self):
+        return self._data
+
+
+def test_rate_limiter():
+    """Test per-method pacing and the Retry-After backstop"""
+    print("\n🧪 Testing Rate Limiter")
+    print("-" * 30)
+
+    budget = exporter.MethodBudget("test.method", 600, headroom=1.0, burst=2)
+    waits = [budget.reserve() for _ in range(4)]
+    assert waits[0] == 0 and waits[1] == 0, "Burst should not be paced"
+    assert 0.05 < waits[2] <= 0.1 and 0.15 < waits[3] <= 0.2, f"Bad pacing: {waits}"
+    print("✅ Requests beyond the burst are spaced by the method's interval")
+
+    budget.backoff(1.0)
+    assert budget.reserve() >= 0.9, "Back-off should hold back later requests"
+    stats = {"rate_limited": budget.rate_limited, "requests": budget.requests}
+    assert stats == {"rate_limited": 1, "requests": 5}, f"Bad counters: {stats}"
+    print("✅ Retry-After back-off is shared and counted")
+
+    limiter = exporter.RateLimiter()
+    assert limiter.budget("users.list").limit == 20, "users.list is tier 2"
+    assert limiter.budget("conversations.replies").limit == 50, "replies is tier 3"
+    print("✅ Methods are mapped to their tiers")
+
+    responses = [FakeResponse(429, headers={"Retry-After": "0"}), FakeResponse(200)]
+    old_get, old_sleep = exporter._get_data, exporter.ADDITIONAL_SLEEP_TIME
+    exporter._get_data = lambda url, params: responses.pop(0)
+    exporter.ADDITIONAL_SLEEP_TIME = 0
+    try:
+        r = exporter.get_data("https://slack.com/api/test.retry", {})
+    finally:
+        exporter._get_data, exporter.ADDITIONAL_SLEEP_TIME = old_get, old_sleep
+    assert r.status_code == 200, "get_data should retry after a 429"
+    assert exporter.rate_limiter.stats()["test.retry"]["rate_limited"] == 1
+    print("✅ get_data retries after being rate-limited")
+
+
+def test_concurrent_replies():
+    """Test that concurrent thread fetching keeps the input order"""
+    print("\n🧪 Testing Concurrent Reply Fetching")
+    print("-" * 30)
+
+    import random
+    import time
+
+    def fake_thread_replies(timestamp, channel_id, response_url=None, journal=None):
+        time.sleep(random.random() / 100)
+        return [{"type": "message", "ts": timestamp, "text": channel_id}]
+
+    timestamps = ["%i.000100" % i for i in range(50)]
+    old = exporter.thread_replies
+    exporter.thread_replies = fake_thread_replies
+    try:
+        serial = exporter.channel_replies(timestamps, "C1", workers=1)
+        parallel = exporter.channel_replies(timestamps, "C1", workers=8)
+    finally:
+        exporter.thread_replies = old
+
+    assert [t[0]["ts"] for t in parallel] == timestamps, "Order not preserved"
+    assert parallel == serial, "Concurrent result differs from serial result"
+    print("✅ Threads are returned in input order")
+
+
+def test_async_engine():
+    """Test async pagination and reply ordering"""
+    print("\n🧪 Testing Async Engine")
+    print("-" * 30)
+
+    import asyncio
+    import async_exporter
+
+    if async_exporter.aiohttp is None:
+        print("⚠️  aiohttp not installed, skipping async engine tests")
+        return
+
+    pages = {
+        None: {"ok": True, "messages": [{"ts": "3"}, {"ts": "2"}],
+               "response_metadata": {"next_cursor": "abc"}},
+        "abc": {"ok": True, "messages": [{"ts": "1"}],
+                "response_metadata": {"next_cursor": ""}},
+    }
+
+    async def fake_get_data(url, params, session):
+        await asyncio.sleep(0)
+        return 200, "OK", pages[params.get("cursor")]
+
+    async def fake_thread_replies(
+        timestamp, channel_id, response_url=None, session=None, journal=None
+    ):
+        await asyncio.sleep(float(timestamp) / 1000)
+        return [{"ts": timestamp}]
+
+    old_get, old_replies = async_exporter.get_data, async_exporter.thread_replies
+    async_exporter.get_data = fake_get_data
+    async_exporter.thread_replies = fake_thread_replies
+    try:
+        msgs = async_exporter.run(async_exporter.channel_history("C1", session=object()))
+        timestamps = [str(i) for i in range(20, 0, -1)]
+        threads = async_exporter.run(
+            async_exporter.channel_replies(timestamps, "C1", session=object())
+        )
+    finally:
+        async_exporter.get_data, async_exporter.thread_replies = old_get, old_replies
+
+    assert [m["ts"] for m in msgs] == ["3", "2", "1"], f"Bad pagination: {msgs}"
+    print("✅ Async pagination follows cursors")
+    assert [t[0]["ts"] for t in threads] == timestamps, "Order not preserved"
+    print("✅ Async replies keep input order")
+
+
+def test_streaming():
+    """Test page-at-a-time pagination and the incremental JSON writer"""
+    print("\n🧪 Testing Streaming Output")
+    print("-" * 30)
+
+    import io
+    import json
+
+    pages = {
+        None: {"ok": True, "messages": [{"ts": "3"}, {"ts": "2"}],
+               "response_metadata": {"next_cursor": "abc"}},
+        "abc": {"ok": True, "messages": [{"ts": "1"}]},
+    }
+    old = exporter.get_data
+    exporter.get_data = lambda url, params: FakeResponse(200, pages[params.get("cursor")])
+    try:
+        streamed = list(exporter.iter_channel_history("C1"))
+        flat = exporter.channel_history("C1")
+    finally:
+        exporter.get_data = old
+
+    assert streamed == [[{"ts": "3"}, {"ts": "2"}], [{"ts": "1"}]], "Bad pages"
+    assert flat == [m for page in streamed for m in page], "Bad flattening"
+    print("✅ History is yielded one page at a time")
+
+    items = [{"a": [1, 2], "b": "ü"}, [], {"c": {"d": None}}]
+    for indent in (None, 4):
+        for data in (items, []):
+            out = io.StringIO()
+            writer = exporter.JsonArrayWriter(out, indent=indent)
+            writer.write_all(data)
+            writer.close()
+            assert out.getvalue() == json.dumps(data, indent=indent), out.getvalue()
+    print("✅ JsonArrayWriter matches json.dump output")
+
+    expected = {
+        "json": lambda data: json.dumps(data, indent=4),
+        "json-compact": lambda data: json.dumps(data, separators=(",", ":")),
+        "jsonl": lambda data: "".join(json.dumps(x) + "\n" for x in data),
+    }
+    for fmt, dumps in expected.items():
+        for data in (items, []):
+            out = io.StringIO()
+            writer = exporter.json_writer(out, fmt)
+            writer.write_all(data)
+            writer.close()
+            assert out.getvalue() == dumps(data), "%s: %s" % (fmt, out.getvalue())
+    assert exporter.output_extension("jsonl") == ".jsonl"
+    assert exporter.output_extension("json-compact") == ".json"
+    print("✅ Compact JSON and JSON Lines writers produce valid output")
+
+    thread = [{"ts": "1.0", "thread_ts": "1.0"}, {"ts": "1.5"}]
+    out = io.StringIO()
+    exporter.json_writer(out, "jsonl").write_thread(thread)
+    lines = [json.loads(x) for x in out.getvalue().splitlines()]
+    assert lines == [{"ts": "1.0", "thread_ts": "1.0"}, {"ts": "1.5", "thread_ts": "1.0"}], lines
+    out = io.StringIO()
+    writer = exporter.json_writer(out, "json")
+    writer.write_thread(thread)
+    writer.close()
+    assert json.loads(out.getvalue()) == [thread], out.getvalue()
+    print("✅ Reply threads are one message per line in JSON Lines")
+
+
+def test_incremental_merge():
+    """Test prepending a newer export to an older one"""
+    print("\n🧪 Testing Incremental Export Merging")
+    print("-" * 30)
+
+    import tempfile
+
+    sep = "*" * 24
+    old = [{"type": "message", "ts": "2", "text": "b"}, {"type": "message", "ts": "1", "text": "a"}]
+    new = [{"type": "message", "ts": "4", "text": "d"}, {"type": "message", "ts": "3", "text": "c"}]
+
+    def text_export(msgs):
+        return "Channel ID: C1\nChannel Name: x\n%i Messages\n%s\n\n%s" % (
+            len(msgs), sep, exporter.parse_channel_history(msgs, []))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path, new_path = os.path.join(tmp, "c.txt"), os.path.join(tmp, "c.txt.new")
+        for name, data in ((path, text_export(old)), (new_path, text_export(new))):
+            with open(name, "w", encoding="utf-8") as f:
+                f.write(data)
+        exporter.merge_export(new_path, path, sep)
+        with open(path, encoding="utf-8") as f:
+            assert f.read() == text_export(new + old), "Bad text merge"
+        assert not os.path.exists(new_path), "New file should be removed"
+        print("✅ Text exports are merged with an updated count")
+
+        for fmt, ext in (("json", ""), ("json-compact", ".bz2"), ("jsonl", ".gz"), ("json", ".xz")):
+            path = os.path.join(tmp, "c" + exporter.output_extension(fmt) + ext)
+            new_path = exporter.with_suffix(path, ".new")
+
+            def dump(name, data):
+                with exporter.open_file(name, "w") as f:
+                    writer = exporter.json_writer(f, fmt)
+                    writer.write_all(data)
+                    writer.close()
+
+            for old_data, new_data in ((old, new), ([], new), (old, [])):
+                dump(path, old_data)
+                dump(new_path, new_data)
+                exporter.merge_export(new_path, path)
+                with exporter.open_file(path) as f:
+                    merged = f.read()
+                dump(new_path, new_data + old_data)
+                with exporter.open_file(new_path) as f:
+                    assert merged == f.read(), "Bad %s%s merge" % (fmt, ext)
+        print("✅ JSON and JSON Lines exports are merged without loading the old file")
+
+        path = os.path.join(tmp, "c.txt.gz")
+        new_path = exporter.with_suffix(path, ".new")
+        assert new_path.endswith("c.txt.new.gz"), new_path
+        for name, data in ((path, text_export(old)), (new_path, text_export(new))):
+            with exporter.open_file(name, "w") as f:
+                f.write(data)
+        exporter.merge_export(new_path, path, sep)
+        with open(path, "rb") as f:
+            assert f.read(2) == b"\x1f\x8b", "Merged file is not gzip"
+        with exporter.open_file(path) as f:
+            assert f.read() == text_export(new + old), "Bad compressed text merge"
+        print("✅ Compressed exports are merged in their compressed form")
+
+        state = exporter.ExportState(os.path.join(tmp, "state.json"))
+        state.update("channel_C1", "10.5")
+        state.update("channel_C1", "9.0")
+        state = exporter.ExportState(os.path.join(tmp, "state.json"))
+        assert state.latest_ts("channel_C1") == "10.5", "High-water mark went back"
+        print("✅ High-water marks are persisted and only move forward")
+
+
+def run_cli(args, messages, server=None):
+    """Run exporter.py as a script against a fake Slack with one channel
+
+    With a FakeFileServer, its files are listed by files.list and served.
+    """
+    import runpy
+    from unittest import mock
+
+    def fake_get(session, url, params=None, **kwargs):
+        if server is not None and url in server.files:
+            return server.get(url, **kwargs)
+        method = url.rsplit("/", 1)[-1]
+        if method == "files.list":
+            data = {"ok": True, "paging": {"pages": 1}, "files": [
+                {"id": "F%i" % i, "name": "%i.bin" % i, "url_private": url,
+                 "size": len(body)}
+                for i, (url, body) in enumerate(sorted(server.files.items()))
+            ]}
+        elif method == "conversations.list":
+            data = {"ok": True, "channels": [{"id": "C1", "name": "general"}]}
+        elif method == "users.list":
+            data = {"ok": True, "members": [{"id": "U1", "name": "alice"}]}
+        else:
+            oldest = float(params.get("oldest", 0))
+            data = {"ok": True, "messages": [m for m in messages if float(m["ts"]) > oldest]}
+        return FakeResponse(200, data)
+
+    argv = ["exporter.py", "--cache-ttl", "0"] + args
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "exporter.py")
+    with mock.patch("requests.Session.get", fake_get), \
+            mock.patch("config.is_channel_allowed", lambda ch_id: True), \
+            mock.patch("config.get_allowed_channels", lambda: []), \
+            mock.patch.object(sys, "argv", argv):
+        runpy.run_path(path, run_name="__main__")
+
+
+def test_incremental_formats():
+    """Test that incremental runs keep one high-water mark per output file"""
+    print("\n🧪 Testing Incremental Exports Across Formats")
+    print("-" * 30)
+
+    import io
+    import json
+    import tempfile
+    from contextlib import redirect_stdout
+
+    msgs = [{"type": "message", "ts": "%i.0" % i, "user": "U1", "text": str(i)}
+            for i in range(10, 0, -1)]
+
+    def read_json(path, fmt):
+        with exporter.open_file(path) as f:
+            if fmt == "jsonl":
+                return [json.loads(line) for line in f]
+            return json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmp, redirect_stdout(io.StringIO()):
+        incremental = ["-c", "--ch", "C1", "--incremental", "-o", tmp]
+        run_cli(incremental + ["--format", "json"], msgs[5:])
+        run_cli(incremental + ["--format", "jsonl"], msgs)
+        jsonl = os.path.join(tmp, "channel_C1.jsonl")
+        assert read_json(jsonl, "jsonl") == msgs, "New format did not start in full"
+
+        run_cli(incremental + ["--format", "json"], msgs)
+        json_path = os.path.join(tmp, "channel_C1.json")
+        assert read_json(json_path, "json") == msgs, \
+            "Old format was not continued from its own mark"
+
+        run_cli(incremental + ["--format", "json-compact"], msgs)
+        with open(json_path, encoding="utf-8") as f:
+            assert f.read() == json.dumps(msgs, separators=(",", ":")), \
+                "Indented and compact JSON were merged"
+        run_cli(incremental + ["--format", "json"], msgs)
+        with open(json_path, encoding="utf-8") as f:
+            assert f.read() == json.dumps(msgs, indent=4), "Compact JSON was merged"
+
+        os.remove(jsonl)
+        run_cli(incremental + ["--format", "jsonl", "--stream"], msgs)
+        assert read_json(jsonl, "jsonl") == msgs, "Deleted output not exported in full"
+    print("✅ Switching formats or deleting an output triggers a full export")
+
+    import shutil
+
+    with tempfile.TemporaryDirectory() as tmp, redirect_stdout(io.StringIO()):
+        incremental = ["-c", "--ch", "C1", "--incremental", "-o", tmp]
+        state_path = os.path.join(tmp, exporter.EXPORT_STATE_FILE)
+        run_cli(incremental, msgs[5:])
+        shutil.copy(state_path, state_path + ".old")
+        run_cli(incremental, msgs)
+        # as if the second run died after merging, before saving its mark
+        os.replace(state_path + ".old", state_path)
+        run_cli(incremental + ["--resume"], msgs)
+        with open(os.path.join(tmp, "channel_C1.txt"), encoding="utf-8") as f:
+            text = f.read()
+        lines = text.splitlines()
+        assert "10 Messages" in lines and lines.count("10") == 1, text
+    print("✅ An output changed after its mark was saved is exported in full")
+
+
+def test_jobs_need_output_directory():
+    """Test that concurrent exports are not interleaved on stdout"""
+    print("\n🧪 Testing --jobs Without -o")
+    print("-" * 30)
+
+    import io
+    from contextlib import redirect_stderr
+
+    for args in (["-c", "--jobs", "2"], ["-c", "--jobs", "2", "--stream"]):
+        try:
+            with redirect_stderr(io.StringIO()) as err:
+                run_cli(args, [])
+            assert False, "%s should be rejected" % args
+        except SystemExit as e:
+            assert e.code == 2, e.code
+        assert "--jobs greater than 1 needs" in err.getvalue(), err.getvalue()
+    print("✅ --jobs greater than 1 is rejected without -o")
+
+
+def test_resumable_pagination():
+    """Test that journaled pagination resumes after the last saved page"""
+    print("\n🧪 Testing Resumable Pagination")
+    print("-" * 30)
+
+    import tempfile
+
+    pages = {
+        None: {"ok": True, "messages": [{"ts": "3"}], "response_metadata": {"next_cursor": "a"}},
+        "a": {"ok": True, "messages": [{"ts": "2"}], "response_metadata": {"next_cursor": "b"}},
+        "b": {"ok": True, "messages": [{"ts": "1"}]},
+    }
+    requested = []
+
+    def fake_get_data(url, params):
+        requested.append(params.get("cursor"))
+        if params.get("cursor") == "b" and len(requested) == 3:
+            raise ConnectionError("network went away")
+        return FakeResponse(200, pages[params.get("cursor")])
+
+    old = exporter.get_data
+    exporter.get_data = fake_get_data
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = exporter.JournalStore(os.path.join(tmp, "C1"))
+            try:
+                exporter.channel_history("C1", journal=store.journal("history"))
+                assert False, "First attempt should have failed"
+            except ConnectionError:
+                pass
+            with open(os.path.join(tmp, "C1", "history.jsonl"), "a") as f:
+                f.write('{"next_cursor": "zz", "ite')  # torn write
+            msgs = exporter.channel_history("C1", journal=store.journal("history"))
+            assert [m["ts"] for m in msgs] == ["3", "2", "1"], f"Bad resume: {msgs}"
+            assert requested == [None, "a", "b", "b"], f"Pages refetched: {requested}"
+            print("✅ Fetching resumes from the journaled cursor")
+
+            msgs = exporter.channel_history("C1", journal=store.journal("history"))
+            assert len(requested) == 4 and len(msgs) == 3, "Complete journal refetched"
+            msgs = exporter.channel_history("C1", oldest="1", journal=store.journal("history"))
+            assert len(requested) == 7, "Journal of other parameters was replayed"
+            print("✅ Complete journals are replayed only for the same request")
+
+            store.discard()
+            assert not os.path.exists(os.path.join(tmp, "C1")), "Journals not removed"
+    finally:
+        exporter.get_data = old
+
+
+USERS = [
+    {"id": "U1", "name": "alice", "profile": {"real_name": "Alice A", "display_name": "al"}},
+    {"id": "U2", "name": "bob", "profile": {"display_name": "bobby"}},
+    {"id": "U3", "name": "carol", "profile": {}},
+]
+CHANNELS = [
+    {"id": "C1", "name": "general", "creator": "U1"},
+    {"id": "D1", "user": "U2", "is_im": True},
+]
+
+
+def test_directory():
+    """Test indexed user/channel lookups against the list-based ones"""
+    print("\n🧪 Testing Workspace Directory")
+    print("-" * 30)
+
+    directory = exporter.Directory(USERS, CHANNELS)
+    for uid in ["U1", "U2", "U3", "U404"]:
+        for real in (False, True):
+            expected = exporter.name_from_uid(uid, USERS, real=real)
+            assert exporter.name_from_uid(uid, directory, real=real) == expected, uid
+    assert directory.display_name("U2") == "bobby", "Wrong display name"
+    print("✅ User names match the list-based lookup")
+
+    for ch_id in ["C1", "D1", "C404"]:
+        expected = exporter.name_from_ch_id(ch_id, CHANNELS)
+        assert exporter.name_from_ch_id(ch_id, directory) == expected, ch_id
+    print("✅ Channel names match the list-based lookup")
+
+    msgs = [{"type": "message", "ts": "1", "user": "U1", "text": "hi <@U2>",
+             "reactions": [{"name": "+1", "users": ["U2", "U3"]}]}]
+    assert exporter.parse_channel_history(msgs, directory) == \
+        exporter.parse_channel_history(msgs, USERS), "Rendering differs"
+    assert exporter.parse_channel_list(CHANNELS, directory) == \
+        exporter.parse_channel_list(CHANNELS, USERS), "Channel list differs"
+    print("✅ Parsers accept a Directory or a plain user list")
+
+
+def test_mrkdwn():
+    """Test single-pass rewriting of mentions, channels and links"""
+    print("\n🧪 Testing mrkdwn Rendering")
+    print("-" * 30)
+
+    directory = exporter.Directory(USERS, CHANNELS)
+    cases = [
+        ("hi <@U1> and <@U2>", "hi <@U1> (alice) and <@U2> (bob)"),
+        ("<@U404> left", "<@U404> left"),
+        ("see <#C1|general> and <#C1>", "see #general and #general"),
+        ("<!here> <!channel> <!subteam^S1|@devs>", "@here @channel @devs"),
+        ("<https://x.io|docs> <https://y.io>", "docs (https://x.io) https://y.io"),
+        ("a &lt;b&gt; <not an entity", "a &lt;b&gt; <not an entity"),
+    ]
+    for text, expected in cases:
+        assert exporter.render_mrkdwn(text, directory) == expected, text
+    print("✅ Entities are rewritten in one pass")
+
+
+def test_streaming_renderers():
+    """Test that text renderers stream to a file handle"""
+    print("\n🧪 Testing Streaming Text Renderers")
+    print("-" * 30)
+
+    import io
+
+    thread = [
+        {"type": "message", "ts": "1", "user": "U1", "text": "parent"},
+        {"type": "message", "ts": "2", "user": "U2", "text": "a\nb", "parent_user_id": "U1"},
+        {"type": "file", "ts": "3"},
+    ]
+    out = io.StringIO()
+    exporter.write_replies(out, [thread], USERS)
+    text = out.getvalue()
+    assert text == exporter.parse_replies([thread], USERS), "Writer and parser differ"
+    reply = text.split("*" * 24)[1]
+    assert "\n\tMessage at" in reply and "\n\ta\n\tb\n" in reply, "Reply not indented"
+    assert text.endswith("\t" + "*" * 24 + "\n\t\n\n"), "Separator not indented"
+    print("✅ Replies are indented and streamed")
+
+    out = io.StringIO()
+    assert exporter.write_channel_history(out, thread[:1], USERS) == 1
+    exporter.write_user_list(out, USERS)
+    exporter.write_channel_list(out, CHANNELS, USERS)
+    assert "[U1] alice (Alice A)" in out.getvalue(), "User list not written"
+    assert "[C1] general: channel created by alice" in out.getvalue(), "Channel list not written"
+    print("✅ History, user and channel lists write to any file handle")
+
+
+class FakeDownload:
+    def __init__(self, status_code, body=b"", headers=None, cut_at=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.body = body
+        self.cut_at = cut_at  # drop the connection after this many bytes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise exporter.requests.HTTPError("%s error" % self.status_code)
+
+    def iter_content(self, chunk_size):
+        body = self.body if self.cut_at is None else self.body[:self.cut_at]
+        for i in range(0, len(body), chunk_size):
+            yield body[i:i + chunk_size]
+        if self.cut_at is not None:
+            raise exporter.requests.ConnectionError("connection dropped")
+
+
+class FakeFileServer:
+    """Stands in for the HTTP session; fails the first `failures[url]` requests
+    and drops the connection half-way through the first `cuts[url]` ones"""
+
+    def __init__(self, files, failures=None, cuts=None, ranges=True):
+        self.files = files
+        self.failures = dict(failures or {})
+        self.cuts = dict(cuts or {})
+        self.ranges = ranges
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def get(self, url, headers=None, timeout=None, stream=False, **kwargs):
+        with self.lock:
+            self.requests.append(url)
+            failing = self.failures.get(url, 0) > 0
+            if failing:
+                self.failures[url] -= 1
+            cut = self.cuts.get(url, 0) > 0
+            if cut:
+                self.cuts[url] -= 1
+        if failing:
+            return FakeDownload(500)
+        body = self.files[url]
+        start = 0
+        range_header = (headers or {}).get("Range")
+        if self.ranges and range_header:
+            start = int(range_header[len("bytes="):-1])
+            if start >= len(body):
+                return FakeDownload(416)
+            content_range = "bytes %i-%i/%i" % (start, len(body) - 1, len(body))
+            return FakeDownload(206, body[start:], {"Content-Range": content_range},
+                                cut_at=(len(body) - start) // 2 if cut else None)
+        return FakeDownload(200, body, cut_at=len(body) // 2 if cut else None)
+
+
+def test_file_downloads():
+    """Test the concurrent, streaming file downloader"""
+    print("\n🧪 Testing File Downloads")
+    print("-" * 30)
+
+    import tempfile
+
+    files = {"https://files/%i" % i: bytes([i]) * (i * 1000 + 1) for i in range(12)}
+    listing = [
+        {"id": "F%i" % i, "name": "a/b %i.bin" % i, "url_private": url, "size": len(body)}
+        for i, (url, body) in enumerate(files.items())
+    ]
+    server = FakeFileServer(dict(files), failures={"https://files/3": 2})
+    saved = (exporter.get_session, exporter.get_file_list, exporter.FILE_RETRY_BACKOFF)
+    exporter.get_session = lambda: server
+    exporter.get_file_list = lambda: iter(listing)
+    exporter.FILE_RETRY_BACKOFF = 0
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            exporter.save_files(tmp, workers=4)
+            names = sorted(n for n in os.listdir(tmp) if n != exporter.FILE_MANIFEST)
+            assert len(names) == 12 and not any(n.endswith(".part") for n in names), names
+            for info in listing:
+                path = os.path.join(tmp, "%s-%s" % (info["id"], "ab %s" % info["name"][4:]))
+                with open(path, "rb") as f:
+                    assert f.read() == files[info["url_private"]], "Bad content"
+            assert server.requests.count("https://files/3") == 3, "Failed file not retried"
+            print("✅ Files are streamed to disk concurrently and retried")
+
+            server.requests.clear()
+            exporter.save_files(tmp, workers=4)
+            assert server.requests == [], "Existing files downloaded again"
+            print("✅ Existing files are skipped")
+
+            manifest = exporter.FileManifest(os.path.join(tmp, exporter.FILE_MANIFEST))
+            import hashlib
+            assert manifest.entries["F7"]["sha256"] == hashlib.sha256(
+                files["https://files/7"]).hexdigest(), "Bad manifest hash"
+            with open(os.path.join(tmp, "F7-ab 7.bin"), "r+b") as f:
+                f.truncate(10)  # cut short, as by a crash
+            with open(os.path.join(tmp, "F8-ab 8.bin"), "r+b") as f:
+                f.write(b"x")  # same size, different content
+            exporter.save_files(tmp, workers=4)
+            assert server.requests == ["https://files/7"], server.requests
+            server.requests.clear()
+            exporter.save_files(tmp, workers=4, verify=True)
+            assert server.requests == ["https://files/8"], server.requests
+            print("✅ Truncated files are fetched again, changed ones with verify")
+
+            os.remove(os.path.join(tmp, exporter.FILE_MANIFEST))
+            server.requests.clear()
+            exporter.save_files(tmp, workers=4)
+            manifest = exporter.FileManifest(os.path.join(tmp, exporter.FILE_MANIFEST))
+            assert server.requests == [] and len(manifest.entries) == 12, "Not adopted"
+            print("✅ Files downloaded before the manifest are adopted")
+
+            server.files["https://files/2"] = b"short"
+            os.remove(os.path.join(tmp, "F2-ab 2.bin"))
+            assert not exporter.fetch_file(listing[2], tmp, manifest=manifest), "Short file"
+            assert not os.path.exists(os.path.join(tmp, "F2-ab 2.bin")), "Short file kept"
+            server.files["https://files/2"] = files["https://files/2"]
+            print("✅ Downloads with the wrong size are retried and rejected")
+
+            for ranges in (True, False):
+                url = "https://files/11"
+                path = os.path.join(tmp, "F11-ab 11.bin")
+                os.remove(path)
+                server.ranges = ranges
+                server.cuts[url] = 2
+                server.requests.clear()
+                stats = exporter.DownloadStats()
+                assert exporter.fetch_file(listing[11], tmp, stats, manifest), "Not resumed"
+                with open(path, "rb") as f:
+                    assert f.read() == files[url], "Bad resumed content"
+                assert manifest.entries["F11"]["sha256"] == hashlib.sha256(
+                    files[url]).hexdigest(), "Hash does not cover the kept part"
+                assert len(server.requests) == 3, server.requests
+                expected = len(files[url]) * (1 / 2 + 1 / 4 + 1 / 4 if ranges else 2)
+                assert abs(stats.bytes - expected) <= 2, (ranges, stats.bytes, expected)
+                assert stats.resumed == (2 if ranges else 0), stats.resumed
+            server.ranges = True
+            os.replace(path, path + ".part")  # crashed before the rename
+            assert exporter.download_file(path, url, expected_size=len(files[url])), "416"
+            with open(path, "rb") as f:
+                assert f.read() == files[url], "Complete .part not kept"
+            print("✅ Partial downloads are resumed with Range, or refetched without")
+
+            server.failures["https://files/5"] = exporter.FILE_DOWNLOAD_ATTEMPTS
+            os.remove(os.path.join(tmp, "F5-ab 5.bin"))
+            try:
+                exporter.save_files(tmp, workers=4)
+                assert False, "Expected an exception for the failed file"
+            except Exception as e:
+                assert "1 files" in str(e), e
+            assert not os.path.exists(os.path.join(tmp, "F5-ab 5.bin")), "Partial file kept"
+            print("✅ A failing file is reported after the others finish")
+    finally:
+        exporter.get_session, exporter.get_file_list, exporter.FILE_RETRY_BACKOFF = saved
+
+
+def test_file_backups():
+    """Test that --files reruns share one download directory and manifest"""
+    print("\n🧪 Testing Repeated File Backups")
+    print("-" * 30)
+
+    import io
+    import tempfile
+    from contextlib import redirect_stdout
+
+    server = FakeFileServer({"https://files/%i" % i: b"x" * (i + 1) for i in range(3)})
+    with tempfile.TemporaryDirectory() as tmp, redirect_stdout(io.StringIO()):
+        run_cli(["--files", "-o", tmp], [], server)
+        file_dir = os.path.join(tmp, exporter.FILES_DIR)
+        assert os.path.exists(os.path.join(file_dir, exporter.FILE_MANIFEST)), "No manifest"
+        assert len(server.requests) == 3, server.requests
+
+        server.requests.clear()
+        server.files["https://files/3"] = b"new"
+        run_cli(["--files", "-o", tmp], [], server)
+        assert server.requests == ["https://files/3"], server.requests
+        server.requests.clear()
+        run_cli(["--files", "--verify-files", "-o", tmp], [], server)
+        assert server.requests == [], server.requests
+        assert len(os.listdir(file_dir)) == 5, os.listdir(file_dir)
+    print("✅ A rerun only downloads files missing from the manifest")
+
+
+def test_file_listing():
+    """Test files.list filters and page prefetching"""
+    print("\n🧪 Testing File Listing")
+    print("-" * 30)
+
+    requested = []
+    page_two = threading.Event()
+
+    def fake_get_data(url, params):
+        requested.append(dict(params))
+        if params["page"] == 2:
+            page_two.set()
+        files = [{"id": "F%i%i" % (params["page"], i), "size": i * 100} for i in range(3)]
+        return FakeResponse(200, {"ok": True, "files": files, "paging": {"pages": 2}})
+
+    old = exporter.get_data
+    exporter.get_data = fake_get_data
+    try:
+        listing = exporter.get_file_list(channel="C1", types="images,pdfs", max_size=100)
+        first = next(listing)
+        assert page_two.wait(5), "Next page not prefetched"
+        ids = [first["id"]] + [f["id"] for f in listing]
+    finally:
+        exporter.get_data = old
+
+    assert ids == ["F10", "F11", "F20", "F21"], ids
+    assert requested[0] == {"count": exporter.FILES_PAGE_SIZE, "channel": "C1",
+                            "types": "images,pdfs", "page": 1}, requested[0]
+    assert [r["page"] for r in requested] == [1, 2], requested
+    print("✅ Filters are sent to files.list and the next page is prefetched")
+
+
+def test_metadata_cache():
+    """Test the on-disk users/conversations cache"""
+    print("\n🧪 Testing Metadata Cache")
+    print("-" * 30)
+
+    import tempfile
+
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return USERS
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = exporter.MetadataCache(tmp, ttl=60)
+        assert cache.get("users", "T1", fetch) == USERS
+        assert cache.get("users", "T1", fetch) == USERS
+        assert len(calls) == 1 and cache.stats() == {"hits": 1, "misses": 1}, cache.stats()
+        print("✅ A fresh entry is served without fetching")
+
+        other = exporter.MetadataCache(tmp, ttl=60)  # e.g. another gunicorn worker
+        assert other.get("users", "T1", fetch) == USERS and len(calls) == 1, "Not shared"
+        other.get("users", "T2", fetch)
+        assert len(calls) == 2, "Teams share an entry"
+        print("✅ Entries are shared through the directory and kept per team")
+
+        cache.get("users", "T1", fetch, refresh=True)
+        assert len(calls) == 3, "Refresh did not fetch"
+        for name in os.listdir(tmp):
+            os.utime(os.path.join(tmp, name), (0, 0))
+        cache.get("users", "T1", fetch)
+        assert len(calls) == 4, "Expired entry was used"
+        exporter.MetadataCache(tmp, ttl=0).get("users", "T1", fetch)
+        assert len(calls) == 5, "ttl=0 should disable the cache"
+        print("✅ Entries expire after the TTL and can be refreshed")
+
+
+def test_archive_sync():
+    """Test that only messages missing from the archive are fetched"""
+    print("\n🧪 Testing Archive Sync")
+    print("-" * 30)
+
+    import tempfile
+    from archive import Archive
+
+    msgs = [{"type": "message", "ts": "%i.0" % i, "user": "U1", "text": str(i)}
+            for i in range(10, 0, -1)]
+    msgs[5].update(reply_count=1, thread_ts=msgs[5]["ts"])  # ts 5.0
+    reply = {"type": "message", "ts": "5.5", "user": "U2", "thread_ts": "5.0"}
+    history_params, thread_calls = [], []
+
+    def fake_get_data(url, params):
+        if url.endswith("conversations.replies"):
+            thread_calls.append(params["ts"])
+            return FakeResponse(200, {"ok": True, "messages": [msgs[5], reply]})
+        history_params.append(dict(params))
+        oldest = float(params.get("oldest", 0))
+        latest = float(params.get("latest", 1e12))
+        found = [m for m in available if oldest < float(m["ts"]) < latest]
+        return FakeResponse(200, {"ok": True, "messages": found})
+
+    old = exporter.get_data
+    exporter.get_data = fake_get_data
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = Archive(os.path.join(tmp, "archive.db"))
+            available = msgs[4:]  # 6.0 and older
+            first = exporter.archived_history(archive, "C1")
+            assert [m["ts"] for m in first] == [m["ts"] for m in available], first
+            assert archive.latest_ts("C1") == "6.0", archive.latest_ts("C1")
+
+            available = msgs
+            assert exporter.archived_history(archive, "C1") == msgs, "Bad merged history"
+            assert history_params[-1]["oldest"] == "6.0", "Archived messages fetched again"
+            print("✅ Only messages newer than the archive's mark are fetched")
+
+            exporter.sync_history(archive, "C2", oldest="8.0")
+            assert archive.latest_ts("C2") is None, "Partial window moved the mark"
+            print("✅ A bounded fetch does not move the mark")
+
+            threads = exporter.archived_replies(archive, ["5.0"], "C1")
+            threads = exporter.archived_replies(archive, ["5.0"], "C1")
+            assert threads == [[msgs[5], reply]] and thread_calls == ["5.0"], thread_calls
+            print("✅ Archived threads are not fetched again")
+
+            if archive.searchable:
+                import io
+
+                directory = exporter.Directory(
+                    [{"id": "U1", "name": "alice"}], [{"id": "C1", "name": "general"}]
+                )
+                out = io.StringIO()
+                exporter.write_search_results(out, archive.search("7"), directory)
+                assert "in #general [7.0]\nUser: alice" in out.getvalue(), out.getvalue()
+                assert "\n**7**\n" in out.getvalue(), out.getvalue()
+                print("✅ Archived messages are searchable")
+            archive.close()
+    finally:
+        exporter.get_data = old
+
+
+def test_trace_and_profile():
+    """Test the --trace log and the --profile phase timings"""
+    print("\n🧪 Testing Trace Log and Profiler")
+    print("-" * 30)
+
+    import io
+    import json
+    import tempfile
+
+    responses = [FakeResponse(429, headers={"Retry-After": "0"}), FakeResponse(200)]
+    old_get, old_sleep = exporter._get_data, exporter.ADDITIONAL_SLEEP_TIME
+    exporter._get_data = lambda url, params: responses.pop(0)
+    exporter.ADDITIONAL_SLEEP_TIME = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "trace.jsonl")
+        exporter.api_trace = exporter.TraceLog(path)
+        try:
+            exporter.get_data(
+                "https://slack.com/api/conversations.history",
+                {"channel": "C1", "token": "xoxp-secret", "cursor": None},
+            )
+        finally:
+            exporter.api_trace.close()
+            exporter.api_trace = None
+            exporter._get_data, exporter.ADDITIONAL_SLEEP_TIME = old_get, old_sleep
+        with open(path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+
+    assert [r["status"] for r in records] == [429, 200], records
+    assert [r["retries"] for r in records] == [0, 1], records
+    assert records[0]["method"] == "conversations.history"
+    assert records[0]["params"] == {"channel": "C1"}, "Token or empty param traced"
+    assert all(r["bytes"] == 2 and r["latency"] >= 0 for r in records), records
+    print("✅ Every API call is traced without the token")
+
+    profiler = exporter.Profiler()
+    out = io.StringIO()
+    with profiler.channel("C1"), profiler.phase("render"):
+        for page in profiler.iterate("fetch", [[1], [2]]):
+            profiler.writer(out).write("x" * 10)
+    with profiler.phase("fetch"):
+        pass  # outside a channel: not recorded
+    stats = profiler.stats()
+    assert set(stats) == {"C1"}, stats
+    assert set(stats["C1"]) == {"fetch", "render", "write"}, stats
+    assert all(wall >= 0 and cpu >= 0 for wall, cpu in stats["C1"].values()), stats
+    assert out.getvalue() == "x" * 20, "Writes not passed through"
+    assert "C1" in profiler.report() and "all" in profiler.report()
+    disabled = exporter.Profiler(enabled=False)
+    assert disabled.writer(out) is out and not disabled.stats()
+    print("✅ Fetch, render and write are timed per channel")
+
+
+def main():
+    """Run all tests"""
+    print("🔧 Testing Slack Exporter Internals")
+    print("=" * 50)
+
+    try:
+        test_shared_session()
+        test_rate_limiter()
+        test_concurrent_replies()
+        test_async_engine()
+        test_streaming()
+        test_incremental_merge()
+        test_incremental_formats()
+        test_jobs_need_output_directory()
+        test_resumable_pagination()
+        test_directory()
+        test_mrkdwn()
+        test_streaming_renderers()
+        test_file_downloads()
+        test_file_backups()
+        test_file_listing()
+        test_metadata_cache()
+        test_archive_sync()
+        test_trace_and_profile()
+
+        print("\n" + "=" * 50)
+        print("✅ All tests passed!")
+
+    except AssertionError as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Test script for the bot's background job queue.
+"""
+
+import sys
+import threading
+
+from jobs import JobQueue
+
+
+def test_runs_jobs():
+    """Test that queued jobs run on the worker threads"""
+    print("🧪 Testing Job Execution")
+    print("-" * 30)
+
+    jobs = JobQueue(workers=3, max_queued=10)
+    done = []
+    lock = threading.Lock()
+
+    def job(n):
+        with lock:
+            done.append((n, threading.current_thread().name))
+
+    for n in range(10):
+        assert jobs.submit(job, n), "Job refused"
+    jobs.join()
+
+    assert sorted(n for n, _ in done) == list(range(10)), done
+    assert all(name.startswith("export-") for _, name in done), "Ran on caller thread"
+    stats = jobs.stats()
+    assert stats["completed"] == 10 and stats["running"] == 0, stats
+    print("✅ All queued jobs ran in the background")
+
+
+def test_bounded_queue():
+    """Test that a full queue refuses jobs instead of growing"""
+    print("\n🧪 Testing Queue Limit")
+    print("-" * 30)
+
+    jobs = JobQueue(workers=1, max_queued=2)
+    started, release = threading.Event(), threading.Event()
+
+    def blocker():
+        started.set()
+        release.wait(5)
+
+    assert jobs.submit(blocker)
+    assert started.wait(5), "Worker did not start"
+    assert jobs.submit(lambda: None) and jobs.submit(lambda: None), "Queue too small"
+    assert not jobs.submit(lambda: None), "Full queue accepted a job"
+    release.set()
+    jobs.join()
+
+    stats = jobs.stats()
+    assert stats["rejected"] == 1 and stats["completed"] == 3, stats
+    print("✅ Jobs beyond the queue size are rejected")
+
+
+def test_failures():
+    """Test that failing jobs are reported and do not stop the workers"""
+    print("\n🧪 Testing Job Failures")
+    print("-" * 30)
+
+    jobs = JobQueue(workers=1, max_queued=5)
+    errors = []
+
+    def fail():
+        sys.exit(1)  # how the exporter gives up on an API error
+
+    jobs.submit(fail, on_error=errors.append)
+    jobs.submit(lambda: 1 / 0, on_error=errors.append)
+    jobs.submit(lambda: None)
+    jobs.join()
+
+    assert [type(e) for e in errors] == [SystemExit, ZeroDivisionError], errors
+    stats = jobs.stats()
+    assert stats["failed"] == 2 and stats["completed"] == 1, stats
+    print("✅ Errors go to on_error and the worker keeps running")
+
+
+def main():
+    """Run all tests"""
+    print("🔧 Testing Background Jobs")
+    print("=" * 50)
+
+    try:
+        test_runs_jobs()
+        test_bounded_queue()
+        test_failures()
+
+        print("\n" + "=" * 50)
+        print("✅ All tests passed!")
+
+    except AssertionError as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
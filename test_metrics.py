@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Test script for the metrics registry and the exporter's API metrics.
+These tests never talk to Slack; a dummy token is used if none is set.
+"""
+
+import os
+import sys
+
+os.environ.setdefault("SLACK_USER_TOKEN", "xoxp-test")
+
+import metrics
+
+
+def test_rendering():
+    """Test counters, gauges and histograms in the Prometheus text format"""
+    print("🧪 Testing Metrics Rendering")
+    print("-" * 30)
+
+    registry = metrics.Registry()
+    requests = registry.counter("requests_total", "Requests", ("method",))
+    requests.inc(method="a")
+    requests.inc(2, method="a")
+    requests.inc(method='b"c')
+    assert registry.counter("requests_total", "Requests", ("method",)) is requests
+    registry.gauge("queued", "Queued", function=lambda: 7)
+    latency = registry.histogram("latency_seconds", "Latency", ("method",), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value, method="a")
+
+    text = registry.render()
+    assert '# TYPE requests_total counter\n' in text, text
+    assert 'requests_total{method="a"} 3\n' in text, text
+    assert 'requests_total{method="b\\"c"} 1\n' in text, "Label not escaped"
+    assert "queued 7\n" in text, text
+    assert 'latency_seconds_bucket{method="a",le="0.1"} 2\n' in text, text
+    assert 'latency_seconds_bucket{method="a",le="1"} 3\n' in text, text
+    assert 'latency_seconds_bucket{method="a",le="+Inf"} 4\n' in text, text
+    assert 'latency_seconds_sum{method="a"} 3.65\n' in text, text
+    assert 'latency_seconds_count{method="a"} 4\n' in text, text
+    print("✅ Samples are rendered with labels, cumulative buckets and sums")
+
+    try:
+        requests.inc(status="200")
+        assert False, "Wrong labels should be rejected"
+    except ValueError:
+        pass
+    print("✅ Wrong label names are rejected")
+
+
+def test_api_metrics():
+    """Test that get_data records requests, latency, bytes and 429s"""
+    print("\n🧪 Testing API Metrics")
+    print("-" * 30)
+
+    import exporter
+
+    class FakeResponse:
+        def __init__(self, status_code, headers=None):
+            self.status_code = status_code
+            self.headers = headers or {}
+            self.content = b'{"ok": true}'
+
+    method = "metrics.test"
+    url = "https://slack.com/api/" + method
+    responses = [FakeResponse(429, {"Retry-After": "0"}), FakeResponse(200)]
+    old_get, old_sleep = exporter._get_data, exporter.ADDITIONAL_SLEEP_TIME
+    exporter._get_data = lambda url, params: responses.pop(0)
+    exporter.ADDITIONAL_SLEEP_TIME = 0
+    try:
+        assert exporter.get_data(url, {}).status_code == 200
+    finally:
+        exporter._get_data, exporter.ADDITIONAL_SLEEP_TIME = old_get, old_sleep
+
+    assert exporter.API_REQUESTS.value(method=method, status=429) == 1
+    assert exporter.API_REQUESTS.value(method=method, status=200) == 1
+    assert exporter.API_RATE_LIMITED.value(method=method) == 1
+    assert exporter.API_LATENCY.count(method=method) == 2
+    assert exporter.API_RESPONSE_BYTES.value(method=method) == 24
+    assert 'slack_api_rate_limited_total{method="metrics.test"} 1' in metrics.registry.render()
+    pressure = exporter.rate_limiter.pressure()
+    assert pressure["seconds_since_rate_limited"] is not None, pressure
+    print("✅ Requests, latency, bytes and 429s are recorded per method")
+
+
+def main():
+    """Run all tests"""
+    print("🔧 Testing Metrics")
+    print("=" * 50)
+
+    try:
+        test_rendering()
+        test_api_metrics()
+
+        print("\n" + "=" * 50)
+        print("✅ All tests passed!")
+
+    except AssertionError as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()